@@ -3,12 +3,16 @@ import os
 import configparser
 import glob
 import random
+import threading
+import time
 from builtins import str
 from builtins import object
-from flask import Blueprint, request
+from flask import Blueprint, request, jsonify
 from future import standard_library
+import pygame
 from pygame import mixer
 from r2utils import mainconfig
+from .SoundCache import SoundCache
 standard_library.install_aliases()
 
 
@@ -16,7 +20,10 @@ _configfile = mainconfig.mainconfig['config_dir'] + 'audio.cfg'
 
 _config = configparser.SafeConfigParser({'sounds_dir': './sounds/',
                                          'logfile': 'audio.log',
-                                         'volume': '0.3'})
+                                         'volume': '0.3',
+                                         'cache_mb': '32',
+                                         'stream_kb': '1024',
+                                         'preload': 'Happy007,Happy006,Sad__019,MOTIVATR'})
 _config.read(_configfile)
 
 if not os.path.isfile(_configfile):
@@ -67,6 +74,14 @@ def _audio_list():
     return message
 
 
+@api.route('/stats', methods=['GET'])
+def _audio_stats():
+    """GET JSON sound cache use and trigger latency of each sound played"""
+    if request.method == 'GET':
+        return jsonify(audio.Stats())
+    return "Fail"
+
+
 @api.route('/<name>', methods=['GET'])
 def _audio(name):
     """GET to trigger the given sound"""
@@ -135,7 +150,7 @@ def _set_volume(level):
             new_level = 0
         if __debug__:
             print(f"Setting volume to: {new_level}")
-        mixer.music.set_volume(float(new_level))
+        audio.SetVolume(new_level)
     return "Ok"
 
 
@@ -159,9 +174,14 @@ class _AudioLibrary(object):
     'PROC_',
     'WHIST',
     'SCREA'
+
+    Sounds are decoded once and kept in a SoundCache, then played on a
+    reserved mixer channel so a new sound cuts off the last one as before.
+    Files bigger than stream_kb, such as whole songs, and anything the mixer
+    can not decode into a Sound are streamed with mixer.music instead.
     """
 
-    def __init__(self, sounds_dir, volume):
+    def __init__(self, sounds_dir, volume, cache_mb=32, preload=(), stream_kb=1024):
         """
         Init of AudioLibrary class
 
@@ -171,13 +191,80 @@ class _AudioLibrary(object):
              Directory containing sound files
         volume : float
              Initial volume level
+        cache_mb : float
+             Megabytes of decoded audio to keep in memory
+        preload : list
+             Names of sounds to decode at startup, in the background
+        stream_kb : float
+             Files bigger than this are streamed rather than decoded into memory
         """
 
         if __debug__:
             print(f"Initiating audio: sounds_dir = {sounds_dir}")
         mixer.init()
-        mixer.music.set_volume(float(volume))
+        mixer.set_reserved(1)
+        self.channel = mixer.Channel(0)
         self.sounds_dir = sounds_dir
+        self.cache = SoundCache(int(float(cache_mb) * 1024 * 1024))
+        self.stream_size = float(stream_kb) * 1024
+        # name -> [triggers, total seconds, slowest, last] from trigger to the sound playing
+        self.latency = {}
+        self.latency_lock = threading.Lock()
+        self.SetVolume(volume)
+        if preload:
+            threading.Thread(target=self._preload, args=(preload,), daemon=True).start()
+
+    def _preload(self, names):
+        for name in names:
+            try:
+                self.cache.get(self.sounds_dir + name + ".mp3")
+            except Exception as e:
+                print(f"Could not preload sound {name}: {e}")
+        if __debug__:
+            print(f"Preloaded sounds: {self.cache.stats()}")
+
+    def _play(self, name, audio_file):
+        """ Play a file from the cache, falling back to streaming it, and note how long it took to start """
+        start = time.monotonic()
+        sound = None
+        try:
+            if os.path.getsize(audio_file) <= self.stream_size:
+                sound = self.cache.get(audio_file)
+        except (pygame.error, OSError) as e:
+            if __debug__:
+                print(f"Streaming {audio_file}, could not decode it: {e}")
+        if sound is not None:
+            mixer.music.stop()
+            self.channel.play(sound)
+        else:
+            self.channel.stop()
+            mixer.music.load(audio_file)
+            mixer.music.play()
+        taken = time.monotonic() - start
+        if __debug__:
+            print(f"{audio_file} playing after {taken * 1000:.1f}ms")
+        with self.latency_lock:
+            latency = self.latency.setdefault(name, [0, 0.0, 0.0, 0.0])
+            latency[0] += 1
+            latency[1] += taken
+            latency[2] = max(latency[2], taken)
+            latency[3] = taken
+
+    def SetVolume(self, level):
+        """ Set the volume of both cached and streamed sounds """
+        mixer.music.set_volume(float(level))
+        self.channel.set_volume(float(level))
+
+    def Stats(self):
+        """ Sound cache use and per-sound trigger latency in milliseconds """
+        with self.latency_lock:
+            latency = {name: {'triggers': count,
+                              'mean_ms': 1000 * total / count,
+                              'max_ms': 1000 * slowest,
+                              'last_ms': 1000 * last}
+                       for name, (count, total, slowest, last) in self.latency.items()}
+        return {'cache': self.cache.stats(),
+                'latency': latency}
 
     def TriggerSound(self, data):
         """
@@ -192,15 +279,7 @@ class _AudioLibrary(object):
         if __debug__:
             print(f"Playing {data}")
         audio_file = self.sounds_dir + data + ".mp3"
-        # mixer.init()
-        if __debug__:
-            print("Init mixer")
-        mixer.music.load(audio_file)  # % (audio_dir, data))
-        if __debug__:
-            print(f"{audio_file} Loaded")
-        mixer.music.play()
-        if __debug__:
-            print("Play")
+        self._play(data, audio_file)
 
     def TriggerRandomSound(self, data):
         """
@@ -220,15 +299,7 @@ class _AudioLibrary(object):
         audio_file = file_list[random.randint(0, file_idx)]
         if __debug__:
             print(f"Playing {data}")
-        mixer.init()
-        if __debug__:
-            print("Init mixer")
-        mixer.music.load(audio_file)  # % (audio_dir, data))
-        if __debug__:
-            print(f"{audio_file} Loaded")
-        mixer.music.play()
-        if __debug__:
-            print("Play")
+        self._play(os.path.basename(audio_file)[:-4], audio_file)
 
     def ListSounds(self):
         """ Returns the list of sounds available """
@@ -238,4 +309,5 @@ class _AudioLibrary(object):
         return files
 
 
-audio = _AudioLibrary(_defaults['sounds_dir'], _defaults['volume'])
+audio = _AudioLibrary(_defaults['sounds_dir'], _defaults['volume'], _defaults['cache_mb'],
+                      [x for x in _defaults['preload'].split(",") if x != ''], _defaults['stream_kb'])
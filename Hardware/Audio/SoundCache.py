@@ -0,0 +1,72 @@
+"""Cache of decoded sounds so they can be played without reading the SD card"""
+import collections
+import threading
+from builtins import object
+from pygame import mixer
+
+
+class SoundCache(object):
+    """
+    Least recently used cache of decoded pygame mixer Sounds
+
+    Decoded sounds are kept until the total size of their sample buffers
+    goes over budget bytes, at which point the least recently played are
+    dropped. A sound bigger than the whole budget is decoded and returned
+    but not kept.
+    """
+
+    def __init__(self, budget):
+        """
+        Parameters
+        ----------
+        budget : int
+             Most bytes of decoded audio to keep
+        """
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.sounds = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, audio_file):
+        """ Decoded Sound for a file, decoding and caching it if it is not already held """
+        with self.lock:
+            cached = self.sounds.get(audio_file)
+            if cached is not None:
+                self.sounds.move_to_end(audio_file)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        # Decode outside the lock so a slow file does not hold up sounds already in the cache
+        sound = mixer.Sound(audio_file)
+        size = self._bytes(sound)
+        if size > self.budget:
+            return sound
+        with self.lock:
+            if audio_file not in self.sounds:
+                self.sounds[audio_file] = (sound, size)
+                self.size += size
+            while self.size > self.budget:
+                evicted, (evicted_sound, evicted_size) = self.sounds.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+                if __debug__:
+                    print(f"Dropped {evicted} from the sound cache")
+        return sound
+
+    def stats(self):
+        with self.lock:
+            return {'sounds': len(self.sounds),
+                    'bytes': self.size,
+                    'budget': self.budget,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+    @staticmethod
+    def _bytes(sound):
+        """ Size of a Sound's decoded sample buffer """
+        frequency, sample_format, channels = mixer.get_init()
+        return int(sound.get_length() * frequency) * channels * (abs(sample_format) // 8)
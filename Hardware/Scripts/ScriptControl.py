@@ -20,16 +20,23 @@
 from builtins import object
 import configparser
 import glob
+import math
 import os
-import collections
-from flask import Blueprint, request
+from flask import Blueprint, request, jsonify
 from r2utils import mainconfig
 from future import standard_library
 standard_library.install_aliases()
 
 _configfile = mainconfig.mainconfig['config_dir'] + 'scripts.cfg'
 
-_config = configparser.SafeConfigParser({'script_dir': './scripts', 'logfile': 'scripts.log'})
+_config = configparser.SafeConfigParser({'script_dir': './scripts',
+                                         'logfile': 'scripts.log',
+                                         'direct_dispatch': 'true',
+                                         'action_workers': '4',
+                                         'oneshot_limit': '8',
+                                         'oneshot_queue': '16',
+                                         'trace': 'false',
+                                         'trace_size': '4096'})
 _config.read(_configfile)
 
 if not os.path.isfile(_configfile):
@@ -59,11 +66,10 @@ def _script_list():
 
 @api.route('/running', methods=['GET'])
 def _running_scripts():
-    """GET a list of all running scripts and their ID"""
-    message = ""
+    """GET JSON list of all running scripts with their ID, start time, passes and current row"""
     if request.method == 'GET':
-        message += scripts.list_running()
-    return message
+        return jsonify(scripts.running())
+    return "Fail"
 
 
 @api.route('/stop/<script_id>', methods=['GET'])
@@ -78,6 +84,79 @@ def _stop_script(script_id):
     return message
 
 
+@api.route('/stop/<script_id>/safe', methods=['GET'])
+def _safe_stop_script(script_id):
+    """GET a script ID to stop that script and send the servos it moved home"""
+    message = ""
+    if request.method == 'GET':
+        if script_id == "all":
+            message += scripts.stop_all(safe=True)
+        else:
+            message += scripts.stop_script(script_id, safe=True)
+    return message
+
+
+@api.route('/<script_id>/pause', methods=['GET'])
+def _pause_script(script_id):
+    """GET a script ID to pause that script"""
+    message = ""
+    if request.method == 'GET':
+        message += scripts.pause_script(script_id)
+    return message
+
+
+@api.route('/<script_id>/resume', methods=['GET'])
+def _resume_script(script_id):
+    """GET a script ID to carry on a paused script"""
+    message = ""
+    if request.method == 'GET':
+        message += scripts.resume_script(script_id)
+    return message
+
+
+@api.route('/<script_id>/seek/<seconds>', methods=['GET'])
+def _seek_script(script_id, seconds):
+    """GET a script ID and a time in seconds to jump to that point in the script"""
+    message = ""
+    if request.method == 'GET':
+        message += scripts.seek_script(script_id, seconds)
+    return message
+
+
+@api.route('/stats', methods=['GET'])
+def _script_stats():
+    """GET JSON one-shot script queue depth and stop-to-quiet latency of recently stopped scripts"""
+    if request.method == 'GET':
+        return jsonify(scripts.runtime.stats())
+    return "Fail"
+
+
+@api.route('/trace', methods=['GET'])
+def _script_trace():
+    """GET JSON histograms of how late script rows started, and how long they queued and took, by script and action"""
+    if request.method == 'GET':
+        return jsonify(scripts.trace.histograms())
+    return "Fail"
+
+
+@api.route('/trace/on', methods=['GET'])
+def _script_trace_on():
+    """GET to start recording the timing of every script row"""
+    message = ""
+    if request.method == 'GET':
+        message += scripts.set_trace(True)
+    return message
+
+
+@api.route('/trace/off', methods=['GET'])
+def _script_trace_off():
+    """GET to stop recording the timing of script rows"""
+    message = ""
+    if request.method == 'GET':
+        message += scripts.set_trace(False)
+    return message
+
+
 @api.route('/<name>/<loop>', methods=['GET'])
 def _start_script(name, loop):
     """GET to trigger the named script"""
@@ -88,67 +167,100 @@ def _start_script(name, loop):
 
 
 class ScriptControl(object):
-    from .ScriptThread import ScriptThread
-
-    Scripts = collections.namedtuple('Script', 'name, script_id, thread')
+    from .ScriptDispatch import ScriptDispatch
+    from .ScriptRuntime import ScriptRuntime
+    from .ScriptRegistry import ScriptRegistry
+    from .ScriptTrace import ScriptTrace
 
-    def __init__(self, script_dir):
-        self.running_scripts = []
-        self.script_id = 1
+    def __init__(self, script_dir, direct_dispatch=True, action_workers=4, oneshot_limit=8, oneshot_queue=16,
+                 trace=False, trace_size=4096):
+        self.registry = self.ScriptRegistry()
         self.script_dir = script_dir
+        # Actions go straight to the plugin objects, with HTTP only for plugins that are not loaded
+        self.dispatch = self.ScriptDispatch(direct_dispatch)
+        self.runtime = self.ScriptRuntime(self.dispatch, action_workers, on_finished=self.registry.remove,
+                                          oneshot_limit=oneshot_limit, oneshot_queue=oneshot_queue)
+        # Row timing is only recorded once tracing is turned on, in scripts.cfg or through /scripts/trace/on
+        self.trace = self.ScriptTrace(trace_size)
+        if trace:
+            self.runtime.trace = self.trace
+        self.runtime.start()
         if __debug__:
             print(f"Starting script object with path: {script_dir}")
 
-
     def list_running(self):
+        """ Running scripts as id:name lines """
         message = ""
-        for script in self.running_scripts:
+        for script in self.registry.all():
             message += "%s:%s\n" % (script.script_id, script.name)
         return message
 
-    def stop_script(self, kill_id):
-        idx = 0
+    def running(self):
+        """ Snapshot of the running scripts, with when they started, passes made and current row """
+        return self.registry.snapshot()
+
+    def stop_script(self, kill_id, safe=False):
+        """ Stop a script by ID, or every running copy of it by name """
         if __debug__:
             print(f"Trying to stop script ID {kill_id}")
-        for script in self.running_scripts:
-            if (int(script.script_id) == int(kill_id)) or (script.name == kill_id):
-                script.thread.stop()
-                self.running_scripts.pop(idx)
-            idx += 1
+        for script in self.registry.find(kill_id):
+            self.runtime.stop_script(script, safe)
         return "Ok"
 
-    def stop_all(self):
-        idx = 0
+    def stop_all(self, safe=False):
         if __debug__:
             print("Trying to stop all scripts")
-        for script in self.running_scripts:
-            self.stop_script(script.script_id)
-        idx += 1
+        for script in self.registry.all():
+            self.runtime.stop_script(script, safe)
+        return "Ok"
+
+    def pause_script(self, script_id):
+        """ Pause a script by ID, or every running copy of it by name """
+        for script in self.registry.find(script_id):
+            self.runtime.pause(script)
+        return "Ok"
+
+    def resume_script(self, script_id):
+        for script in self.registry.find(script_id):
+            self.runtime.resume(script)
+        return "Ok"
+
+    def seek_script(self, script_id, seconds):
+        """ Jump a script to seconds into its current pass """
+        try:
+            seconds = float(seconds)
+        except ValueError:
+            print(f"Seek time is not a number ({seconds})")
+            return "Fail"
+        if not math.isfinite(seconds):
+            print(f"Seek time is not finite ({seconds})")
+            return "Fail"
+        for script in self.registry.find(script_id):
+            self.runtime.seek(script, seconds)
+        return "Ok"
+
+    def set_trace(self, enabled):
+        """ Turn row tracing on or off, clearing what has been recorded when it is turned on """
+        if enabled:
+            self.trace.clear()
+            self.runtime.trace = self.trace
+        else:
+            self.runtime.trace = None
         return "Ok"
 
     def run_script(self, script, loop):
-        idx = 0
-        current_id = 0
-        self.running_scripts.append(
-            self.Scripts(name=script, script_id=self.script_id, thread=self.ScriptThread(script, loop)))
-        if __debug__:
-            print("ID %s" % self.script_id)
-        for scripts in self.running_scripts:
-            if scripts.script_id == self.script_id:
-                current_id = scripts.script_id
-                scripts.thread.daemon = True
-                scripts.thread.start()
+        path = os.path.join(self.script_dir, '%s.scr' % script)
+        running = self.registry.add(script, path, loop == "1")
         if __debug__:
+            print("ID %s" % running.script_id)
             print(f"Starting script {script}")
         if loop == "1":
             print("Looping")
-        else:
-            for script in self.running_scripts:
-                if int(script.script_id) == int(current_id):
-                    self.running_scripts.pop(idx)
-                idx += 1
-        self.script_id += 1
+        self.runtime.start_script(running)
         return "Ok"
 
 
-scripts = ScriptControl(_defaults['script_dir'])
+scripts = ScriptControl(_defaults['script_dir'], _config.getboolean('DEFAULT', 'direct_dispatch'),
+                        int(_defaults['action_workers']), int(_defaults['oneshot_limit']),
+                        int(_defaults['oneshot_queue']), _config.getboolean('DEFAULT', 'trace'),
+                        int(_defaults['trace_size']))
@@ -0,0 +1,178 @@
+""" Runs compiled script actions against the loaded plugins """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import sys
+import urllib.request
+import urllib.error
+import urllib.parse
+from builtins import object
+from future import standard_library
+from .ScriptProgram import ServoMove, ServoAll, Sound, RandomSound, Flthy, Smoke, PsiMatrix, RSeries
+standard_library.install_aliases()
+
+_base_url = "http://localhost:5000"
+# Seconds to wait for the local API before giving up on an action
+_http_timeout = 2
+
+# Plugin objects that actions can be sent to directly: name -> (module, attribute)
+_plugins = {'servo': ('Hardware.Servo.ServoControl', '_boards'),
+            'group_move': ('Hardware.Servo.ServoControl', 'group_move'),
+            'audio': ('Hardware.Audio.AudioLibrary', 'audio'),
+            'flthy': ('Hardware.Lights.FlthyHPControl', '_flthy'),
+            'rseries': ('Hardware.Lights.RSeriesLogicEngine', '_rseries'),
+            'smoke': ('Hardware.Smoke.SmokeControl', '_smoke')}
+
+
+def plugin(name):
+    """
+    Return a plugin object, or None if its module has not been loaded
+
+    Only modules that main.py has already imported are used, so a script
+    never brings up hardware that is not enabled in the plugins list.
+    """
+    module_name, attribute = _plugins[name]
+    module = sys.modules.get(module_name)
+    if module is None:
+        return None
+    return getattr(module, attribute, None)
+
+
+class ScriptDispatch(object):
+    """
+    Sends script actions straight to the plugin objects in this process.
+    Anything whose plugin is not loaded, or every action if direct is off,
+    goes over HTTP to the local API as before.
+    """
+
+    def __init__(self, direct=True, base_url=_base_url):
+        self.direct = direct
+        self.base_url = base_url
+        self._handlers = {ServoMove: self._servo_move,
+                          ServoAll: self._servo_all,
+                          Sound: self._sound,
+                          RandomSound: self._random_sound,
+                          Flthy: self._flthy,
+                          Smoke: self._smoke,
+                          PsiMatrix: self._psi_matrix,
+                          RSeries: self._rseries}
+
+    def run(self, action):
+        """ Carry out a single non-sleep action """
+        self._handlers[type(action)](action)
+
+    def apply(self, actions):
+        """
+        Carry out a set of actions from ScriptProgram.state_at() as one update
+
+        Servo moves on boards loaded in this process are started together
+        as a single group move, so each board writes them in one tick.
+        Servos a board does not have are left out so the rest still move.
+        Everything else is run in turn.
+        """
+        boards = self._plugin('servo') or {}
+        positions = {}
+        for action in actions:
+            control = boards.get(action.board) if type(action) in (ServoMove, ServoAll) else None
+            if control is None or (type(action) is ServoAll and action.command not in ('open', 'close')):
+                self.run(action)
+            elif type(action) is ServoAll:
+                for servo in control.servos:
+                    positions[(action.board, servo)] = 1 if action.command == 'open' else 0
+            elif action.servo in control.servos:
+                positions[(action.board, action.servo)] = action.position
+            else:
+                print(f"Unknown servo ({action.board}/{action.servo}), not moved")
+        if positions:
+            moves = [(board, servo, position, 0, 0) for (board, servo), position in positions.items()]
+            self._plugin('group_move')(moves)
+
+    def home(self, board, servos=None):
+        """ Send the named servos on a board, or all of them if None, to their home positions """
+        boards = self._plugin('servo')
+        control = boards.get(board) if boards else None
+        if control is None:
+            self._http(f"/{board}/home")
+            return
+        control.home_servos(servos)
+
+    def _plugin(self, name):
+        if not self.direct:
+            return None
+        return plugin(name)
+
+    def _http(self, path):
+        urllib.request.urlopen(self.base_url + path, timeout=_http_timeout)
+
+    def _servo_move(self, action):
+        boards = self._plugin('servo')
+        control = boards.get(action.board) if boards else None
+        if control is None:
+            self._http(f"/{action.board}/{action.servo}/{action.position:g}/{action.duration:g}")
+            return
+        control.servo_command(action.servo, action.position, action.duration)
+
+    def _servo_all(self, action):
+        boards = self._plugin('servo')
+        control = boards.get(action.board) if boards else None
+        if control is None or action.command not in ('open', 'close'):
+            self._http(f"/{action.board}/{action.command}")
+            return
+        if action.command == 'open':
+            control.open_all_servos(0)
+        else:
+            control.close_all_servos(0)
+
+    def _sound(self, action):
+        audio = self._plugin('audio')
+        if audio is None:
+            self._http(f"/audio/{action.name}")
+            return
+        audio.TriggerSound(action.name)
+
+    def _random_sound(self, action):
+        audio = self._plugin('audio')
+        if audio is None:
+            self._http(f"/audio/random/{action.group}")
+            return
+        audio.TriggerRandomSound(action.group)
+
+    def _flthy(self, action):
+        flthy = self._plugin('flthy')
+        if flthy is None:
+            self._http(f"/flthy/raw/{action.command}")
+            return
+        flthy.SendRaw(action.command)
+
+    def _smoke(self, action):
+        smoke = self._plugin('smoke')
+        if smoke is None:
+            self._http(f"/smoke/on/{action.duration}")
+            return
+        smoke.sendRaw('S', action.duration)
+
+    def _psi_matrix(self, action):
+        # There is no psi_matrix plugin in this process, it is only reachable over HTTP
+        self._http(f"/psi_matrix/raw/{action.command}")
+
+    def _rseries(self, action):
+        rseries = self._plugin('rseries')
+        if rseries is None:
+            self._http(f"/rseries/raw/{action.command}")
+            return
+        rseries.SendRaw(action.command)
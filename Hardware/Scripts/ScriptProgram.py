@@ -0,0 +1,231 @@
+""" Compiles .scr files into cached lists of actions """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import collections
+import csv
+import os
+import random
+import threading
+from r2utils import mainconfig
+from future import standard_library
+standard_library.install_aliases()
+
+Sleep = collections.namedtuple('Sleep', 'seconds')
+RandomSleep = collections.namedtuple('RandomSleep', 'low, high')
+ServoMove = collections.namedtuple('ServoMove', 'board, servo, position, duration')
+ServoAll = collections.namedtuple('ServoAll', 'board, command')
+# sync restarts the script's timeline from the moment the sound starts playing
+Sound = collections.namedtuple('Sound', 'name, sync')
+RandomSound = collections.namedtuple('RandomSound', 'group, sync')
+Flthy = collections.namedtuple('Flthy', 'command')
+Smoke = collections.namedtuple('Smoke', 'duration')
+PsiMatrix = collections.namedtuple('PsiMatrix', 'command')
+RSeries = collections.namedtuple('RSeries', 'command')
+# branches is a tuple of programs, each a tuple of actions, that run at the same time
+Parallel = collections.namedtuple('Parallel', 'branches')
+Claim = collections.namedtuple('Claim', 'resources')
+Release = collections.namedtuple('Release', 'resources')
+Priority = collections.namedtuple('Priority', 'level')
+# An action due time seconds after the start of a pass through a script. event_id numbers the events of a pass in
+# row order, and after holds the ids of the events that must finish first: the rows before it in the same sequence
+Event = collections.namedtuple('Event', 'time, action, event_id, after')
+
+_servo_boards = [x for x in mainconfig.mainconfig['servos'].split(",") if x != '']
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _sleep(row):
+    if row[1] == "random":
+        return RandomSleep(low=int(row[2]), high=int(row[3]))
+    return Sleep(seconds=float(row[1]))
+
+
+def _servo(row):
+    if row[1] == "all":
+        return ServoAll(board=row[0], command=row[2])
+    return ServoMove(board=row[0], servo=row[1], position=float(row[2]), duration=float(row[3]))
+
+
+def _sound(row):
+    if row[1] == "random":
+        return RandomSound(group=row[2], sync=row[3:4] == ["sync"])
+    return Sound(name=row[1], sync=row[2:3] == ["sync"])
+
+
+def _resources(row):
+    return tuple(resource for resource in row[1:] if resource != "")
+
+
+_compilers = {'sleep': _sleep,
+              'sound': _sound,
+              'claim': lambda row: Claim(resources=_resources(row)),
+              'release': lambda row: Release(resources=_resources(row)),
+              'priority': lambda row: Priority(level=int(row[1])),
+              'flthy': lambda row: Flthy(command=row[1]),
+              'smoke': lambda row: Smoke(duration=row[1]),
+              'psi_matrix': lambda row: PsiMatrix(command=row[1]),
+              'rseries': lambda row: RSeries(command=row[1])}
+for _board in _servo_boards:
+    _compilers[_board] = _servo
+
+
+def compile_rows(rows, name=""):
+    """
+    Turn parsed .scr rows into a tuple of actions, skipping anything that cannot be run
+
+    Rows between parallel and join run at the same time as each other, with
+    a branch row starting each new sequence within the block. join waits
+    for every branch to finish. Blocks can be nested.
+
+        parallel
+        dome,all,open
+        branch
+        flthy,S1
+        sleep,2
+        flthy,S9
+        join
+
+    claim,<resource>,... takes named resources such as dome-panels for the
+    rest of the script, or until release,<resource>,... A running script
+    holding a resource loses it to, and is stopped by, a claim from a script
+    of the same or higher priority,<n> (default 0). A lower priority script
+    waits for the resource to be released.
+    """
+    program = []
+    # Enclosing programs and the finished branches of each open parallel block
+    blocks = []
+    for number, row in enumerate(rows, 1):
+        if len(row) == 0 or row[0] == "":
+            continue
+        if row[0] == "parallel":
+            blocks.append((program, []))
+            program = []
+            continue
+        if row[0] in ("branch", "join"):
+            if not blocks:
+                print(f"{row[0]} outside a parallel block in script {name}:{number}")
+                continue
+            blocks[-1][1].append(tuple(program))
+            program = []
+            if row[0] == "join":
+                program = _join(blocks.pop())
+            continue
+        compiler = _compilers.get(row[0])
+        if compiler is None:
+            if __debug__:
+                print(f"Do not understand {name}:{number} {row}")
+            continue
+        try:
+            program.append(compiler(row))
+        except (IndexError, ValueError):
+            print(f"Bad row in script {name}:{number} {row}")
+    while blocks:
+        print(f"Missing join in script {name}")
+        blocks[-1][1].append(tuple(program))
+        program = _join(blocks.pop())
+    return tuple(program)
+
+
+def _join(block):
+    """ Close a parallel block, returning the enclosing program with the block added to it """
+    program, branches = block
+    branches = tuple(branch for branch in branches if branch)
+    if branches:
+        program.append(Parallel(branches=branches))
+    return program
+
+
+def load(path):
+    """
+    Compiled program for a .scr file
+
+    The program is cached, and only compiled again when the file's
+    modification time changes.
+    """
+    mtime = os.stat(path).st_mtime
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if __debug__:
+            print(f"Compiling script {path}")
+        with open(path, "rt", encoding="utf-8") as ifile:
+            program = compile_rows(csv.reader(ifile), os.path.basename(path))
+        _cache[path] = (mtime, program)
+    return program
+
+
+def schedule(program, rand=random):
+    """
+    Lay a program out as Events in time order, for one pass through it
+
+    Sleeps become gaps between events, sleep,random rows are drawn from
+    rand, and every branch of a parallel block starts at the same time with
+    the block ending when its longest branch does. Events due at the same
+    time keep the order of their rows. Each event is only to run after the
+    event before it in its own branch, and the first event after a join
+    after the last event of every branch.
+
+    Returns (events, length), length being the duration of the pass in seconds
+    """
+    events = []
+    length, after = _schedule(program, 0.0, (), events, rand)
+    events.sort(key=lambda event: event.time)
+    return tuple(events), length
+
+
+def _schedule(program, start, after, events, rand):
+    """ Add a sequence's events, returning when it ends and the ids of the events it ends with """
+    now = start
+    for action in program:
+        if type(action) is Sleep:
+            now += action.seconds
+        elif type(action) is RandomSleep:
+            now += float(rand.randint(action.low, action.high))
+        elif type(action) is Parallel:
+            ends = [_schedule(branch, now, after, events, rand) for branch in action.branches]
+            now = max(end for end, last in ends)
+            after = tuple(event_id for end, last in ends for event_id in last)
+        else:
+            event = Event(now, action, len(events), after)
+            events.append(event)
+            after = (event.event_id,)
+    return now, after
+
+
+def state_at(events):
+    """
+    Actions that leave the servos and lights as the given events would,
+    with each servo only moved once, straight to where it ends up
+    """
+    boards = {}
+    servos = {}
+    lights = {}
+    for event in events:
+        action = event.action
+        if type(action) is ServoAll:
+            boards[action.board] = action
+            servos = {key: move for key, move in servos.items() if key[0] != action.board}
+        elif type(action) is ServoMove:
+            servos[(action.board, action.servo)] = action._replace(duration=0.0)
+        elif type(action) in (Flthy, RSeries, PsiMatrix):
+            lights[type(action)] = action
+    return tuple(boards.values()) + tuple(servos.values()) + tuple(lights.values())
@@ -0,0 +1,98 @@
+""" Index of the scripts currently running """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import threading
+import time
+from builtins import object
+from .ScriptRuntime import RunningScript
+
+
+class ScriptRegistry(object):
+    """
+    Running scripts indexed by ID and by name.
+
+    Scripts are added when they start and removed by the runtime once they
+    have finished, so adding, removing and finding a script never scans
+    the others. All access is under lock, and lookups return copies so a
+    caller can stop scripts while walking the result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.by_id = {}
+        # name -> {script_id: RunningScript}, in the order they were started
+        self.by_name = {}
+
+    def add(self, name, path, loop=False):
+        """ Create a RunningScript with the next ID and index it """
+        with self.lock:
+            script = RunningScript(name, self.next_id, path, loop)
+            self.next_id += 1
+            self.by_id[script.script_id] = script
+            self.by_name.setdefault(name, {})[script.script_id] = script
+        return script
+
+    def remove(self, script):
+        with self.lock:
+            self.by_id.pop(script.script_id, None)
+            named = self.by_name.get(script.name)
+            if named is not None:
+                named.pop(script.script_id, None)
+                if not named:
+                    del self.by_name[script.name]
+
+    def find(self, key):
+        """ Scripts matching an ID, or every running copy of a script if key is a name """
+        with self.lock:
+            if str(key).isdigit():
+                script = self.by_id.get(int(key))
+                return [script] if script is not None else []
+            return list(self.by_name.get(key, {}).values())
+
+    def all(self):
+        with self.lock:
+            return list(self.by_id.values())
+
+    def snapshot(self):
+        """ List of dicts describing every running script """
+        return [{'id': script.script_id,
+                 'name': script.name,
+                 'started': script.started,
+                 'loop': script.loop,
+                 'passes': script.passes,
+                 'row': script.row,
+                 'position': self._position(script),
+                 'length': script.length,
+                 'paused': script.paused_at is not None,
+                 'priority': script.priority,
+                 'claims': sorted(script.claims),
+                 'stopping': script.stopping} for script in self.all()]
+
+    @staticmethod
+    def _position(script):
+        """ Seconds into the current pass """
+        if script.task is None:
+            return 0.0
+        now = script.paused_at if script.paused_at is not None else time.monotonic()
+        return min(max(now - script.origin, 0.0), script.length)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.by_id)
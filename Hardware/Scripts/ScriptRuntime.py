@@ -0,0 +1,467 @@
+""" Runs every script as a coroutine on a single event loop thread """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import asyncio
+import bisect
+import collections
+import threading
+import time
+from builtins import object
+from concurrent.futures import ThreadPoolExecutor
+from future import standard_library
+from . import ScriptProgram
+from .ScriptProgram import ServoMove, ServoAll, Claim, Release, Priority
+standard_library.install_aliases()
+
+
+class RunningScript(object):
+    """ A script started on the runtime, and where it has got to """
+
+    def __init__(self, name, script_id, path, loop=False):
+        self.name = name
+        self.script_id = script_id
+        self.path = path
+        self.loop = loop
+        self.started = time.time()
+        self.passes = 0
+        self.task = None
+        # Events of the current pass, from ScriptProgram.schedule(), and the next one to run
+        self.events = ()
+        self.length = 0.0
+        self.row = 0
+        # event_id -> asyncio.Task of each event of the current pass that has been started
+        self.running = {}
+        # Event loop time the current pass started at, event n is due at origin + events[n].time
+        self.origin = 0.0
+        self.paused_at = None
+        self.seek_to = None
+        # asyncio.Event set to wake the script when it is paused, resumed or seeks
+        self.wake = None
+        self.priority = 0
+        # Named resources the script holds
+        self.claims = set()
+        # Servos the script has moved, board -> set of servo names, or None for every servo on the board
+        self.touched = {}
+        # Actions running on a worker
+        self.inflight = set()
+        self.stopping = False
+        self.safe_stop = False
+        self.stop_requested = None
+        self.stop_latency = None
+        # Set once the script has stopped and nothing it started is still running
+        self.finished = threading.Event()
+
+
+class ScriptRuntime(threading.Thread):
+    """
+    One thread running an asyncio event loop that plays every script.
+
+    Each script is a coroutine, so waiting between rows is an await rather
+    than a blocked thread and a running script costs a task object rather
+    than an OS thread. Stopping a script cancels its task, which wakes it
+    out of any wait straight away.
+
+    Each pass through a script is laid out by ScriptProgram.schedule() as
+    events at times from the start of the pass, and every event waits for
+    its absolute time. An event that is due starts as its own task without
+    waiting for the ones before it, other than those earlier in its own
+    branch, so a slow action only holds up the rest of its branch. Only a
+    claim or a sync sound, which move the timeline, are waited for. Time
+    spent carrying out actions is taken out of the following wait rather
+    than adding up over a long or looping script, and each pass starts
+    exactly where the last one ended. A sound row ending in sync moves the
+    start of the pass so the sound's event is when that sound started
+    playing, keeping the rest of the choreography locked to it.
+
+    A script can be paused, resumed, and seek to any time in its current
+    pass. Seeking sends every servo and light straight to the state the
+    events before that time would have left them in, as one update, and
+    carries on from there.
+
+    Actions are handed to dispatch.run() on a small pool of worker threads
+    so that a slow action, such as an HTTP fallback or loading a sound,
+    never holds up the other scripts on the loop. When a script is stopped
+    any of its actions still waiting for a worker are dropped, one already
+    running is left to finish, and with a safe stop the servos the script
+    moved are then sent home. The time from the stop request until the
+    script is quiet is kept for the last STOP_HISTORY stops.
+
+    Named resources claimed by scripts are arbitrated here. A claim on a
+    resource held by another script of the same or lower priority takes it
+    and stops that script, otherwise the claim waits until it is released
+    and the rest of the claiming script is moved on by the time it waited.
+
+    At most oneshot_limit non-looping scripts play at once. Any more wait
+    in a queue of up to oneshot_queue scripts and start in turn as others
+    finish, and anything beyond that is dropped, so mashing buttons that
+    trigger scripts can not pile up work. Looping scripts are not limited.
+
+    When trace is a ScriptTrace, every row played is recorded in it with
+    when it was due, when the runtime got to it, when a worker picked it up
+    and when it finished.
+    """
+
+    STOP_HISTORY = 100
+
+    def __init__(self, dispatch, workers=4, on_finished=None, oneshot_limit=8, oneshot_queue=16):
+        threading.Thread.__init__(self, name='ScriptRuntime', daemon=True)
+        self.dispatch = dispatch
+        # Called with each RunningScript once it has finished or been stopped
+        self.on_finished = on_finished
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ScriptAction')
+        self.stop_latencies = collections.deque(maxlen=self.STOP_HISTORY)
+        # One-shot scripts, only touched on the event loop thread
+        self.oneshot_limit = oneshot_limit
+        self.oneshot_queue = oneshot_queue
+        self.oneshot_running = 0
+        self.oneshot_waiting = collections.deque()
+        self.oneshot_queued_max = 0
+        self.oneshot_rejected = 0
+        # resource -> (RunningScript holding it, asyncio.Event set when it is released)
+        self.claims = {}
+        self.trace = None
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start_script(self, script):
+        """ Start playing a RunningScript, returns straight away """
+        self.loop.call_soon_threadsafe(self._start, script)
+        return script
+
+    def stop_script(self, script, safe=False):
+        """
+        Stop a RunningScript, returns straight away
+
+        Parameters
+        ----------
+        script : RunningScript
+             Script to stop
+        safe : bool
+             Send every servo the script has moved home once it has stopped
+        """
+        if script.stopping:
+            return
+        script.stop_requested = time.monotonic()
+        script.safe_stop = safe
+        script.stopping = True
+        self.loop.call_soon_threadsafe(self._cancel, script)
+
+    def pause(self, script):
+        """ Pause a RunningScript before its next event """
+        self.loop.call_soon_threadsafe(self._pause, script)
+
+    def resume(self, script):
+        """ Carry on a paused RunningScript from where it was paused """
+        self.loop.call_soon_threadsafe(self._resume, script)
+
+    def seek(self, script, seconds):
+        """ Move a RunningScript to seconds into its current pass """
+        self.loop.call_soon_threadsafe(self._seek_request, script, seconds)
+
+    def stats(self):
+        """ One-shot script queue depth, and stop-to-quiet latency of recently stopped scripts in milliseconds """
+        stats = {'oneshot_running': self.oneshot_running,
+                 'oneshot_queued': len(self.oneshot_waiting),
+                 'oneshot_queued_max': self.oneshot_queued_max,
+                 'oneshot_rejected': self.oneshot_rejected}
+        latencies = sorted(self.stop_latencies)
+        stats['stopped'] = len(latencies)
+        if latencies:
+            stats['stop_p50'] = 1000 * latencies[len(latencies) // 2]
+            stats['stop_p99'] = 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            stats['stop_max'] = 1000 * latencies[-1]
+        return stats
+
+    def _start(self, script):
+        if script.stopping:
+            self._quiet(script)
+            return
+        if not script.loop:
+            if self.oneshot_running >= self.oneshot_limit:
+                if len(self.oneshot_waiting) >= self.oneshot_queue:
+                    print(f"Too many scripts waiting, dropping {script.name}")
+                    self.oneshot_rejected += 1
+                    self._quiet(script)
+                    return
+                self.oneshot_waiting.append(script)
+                self.oneshot_queued_max = max(self.oneshot_queued_max, len(self.oneshot_waiting))
+                return
+            self.oneshot_running += 1
+        script.task = self.loop.create_task(self._play(script))
+
+    def _cancel(self, script):
+        if script.task is not None:
+            script.task.cancel()
+        elif script in self.oneshot_waiting:
+            self.oneshot_waiting.remove(script)
+            self._quiet(script)
+
+    def _pause(self, script):
+        if script.paused_at is None:
+            script.paused_at = self.loop.time()
+            self._wake(script)
+
+    def _resume(self, script):
+        if script.paused_at is not None:
+            script.origin += self.loop.time() - script.paused_at
+            script.paused_at = None
+            self._wake(script)
+
+    def _seek_request(self, script, seconds):
+        script.seek_to = seconds
+        self._wake(script)
+
+    def _wake(self, script):
+        if script.wake is not None:
+            script.wake.set()
+
+    def _oneshot_done(self):
+        """ Free a one-shot slot, starting the next waiting script if there is one """
+        self.oneshot_running -= 1
+        while self.oneshot_waiting and self.oneshot_running < self.oneshot_limit:
+            self.oneshot_running += 1
+            script = self.oneshot_waiting.popleft()
+            script.task = self.loop.create_task(self._play(script))
+
+    async def _play(self, script):
+        if __debug__:
+            print(f"Starting script {script.name}")
+        script.wake = asyncio.Event()
+        script.origin = self.loop.time()
+        if script.paused_at is not None:
+            script.paused_at = script.origin
+        try:
+            while True:
+                program = ScriptProgram.load(script.path)
+                if not program:
+                    break
+                script.events, script.length = ScriptProgram.schedule(program)
+                script.row = 0
+                script.running = {}
+                while True:
+                    done = script.row >= len(script.events)
+                    due = script.length if done else script.events[script.row].time
+                    if not await self._wait(script, due):
+                        continue
+                    if done:
+                        break
+                    event = script.events[script.row]
+                    script.row += 1
+                    task = self.loop.create_task(self._run_event(script, event))
+                    script.running[event.event_id] = task
+                    if type(event.action) is Claim or getattr(event.action, 'sync', False):
+                        await task
+                if script.running:
+                    await asyncio.wait(list(script.running.values()))
+                script.passes += 1
+                script.origin += script.length
+                if not script.loop:
+                    break
+                if __debug__:
+                    print("Looping...")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Script {script.name} failed: {e}")
+        finally:
+            print(f"Stopping script {script.name}")
+            self._cancel_events(script)
+            if not script.loop:
+                self._oneshot_done()
+            self._release(script, list(script.claims))
+            inflight = [asyncio.wrap_future(future) for future in script.inflight if not future.done()]
+            if inflight:
+                waiting = asyncio.gather(*inflight, return_exceptions=True)
+                waiting.add_done_callback(lambda f: self._finish(script))
+            else:
+                self._finish(script)
+
+    async def _wait(self, script, due):
+        """
+        Wait until due seconds into the pass, for as long as the script is paused
+
+        Returns False if the script seeked while waiting, in which case its
+        row has changed and the caller should look again at what is next.
+        """
+        while True:
+            if script.seek_to is not None:
+                await self._seek(script)
+                return False
+            delay = None
+            if script.paused_at is None:
+                delay = script.origin + due - self.loop.time()
+                if delay <= 0:
+                    return True
+            script.wake.clear()
+            try:
+                await asyncio.wait_for(script.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _seek(self, script):
+        """ Jump to script.seek_to seconds into the pass, bringing servos, lights and claims up to date """
+        seconds = min(max(float(script.seek_to), 0.0), script.length)
+        script.seek_to = None
+        row = bisect.bisect_left([event.time for event in script.events], seconds)
+        if __debug__:
+            print(f"Script {script.name} seeking to {seconds}s, row {row}")
+        passed = script.events[:row]
+        claims = set()
+        for event in passed:
+            action = event.action
+            if type(action) is Priority:
+                script.priority = action.level
+            elif type(action) is Claim:
+                claims.update(action.resources)
+            elif type(action) is Release:
+                claims.difference_update(action.resources)
+        self._cancel_events(script)
+        self._release(script, script.claims - claims)
+        script.row = row
+        state = ScriptProgram.state_at(passed)
+        for action in state:
+            self._touch(script, action)
+        now = self.loop.time()
+        if state:
+            await self._run_on_worker(script, self.dispatch.apply, state)
+        await self._claim(script, sorted(claims - script.claims))
+        script.origin = now - seconds
+        if script.paused_at is not None:
+            script.paused_at = now
+
+    def _cancel_events(self, script):
+        """ Drop every event of the pass that has not finished, actions already on a worker are left to finish """
+        for task in script.running.values():
+            task.cancel()
+        script.running = {}
+
+    async def _run_event(self, script, event):
+        """ Run an event once the events before it in its branch have finished """
+        after = [script.running[event_id] for event_id in event.after if event_id in script.running]
+        if after:
+            await asyncio.wait(after)
+        try:
+            await self._run_action(script, event)
+        except Exception as e:
+            print(f"Script {script.name} failed: {e}")
+            script.task.cancel()
+
+    def _touch(self, script, action):
+        """ Note the servos an action moves, for a safe stop """
+        if type(action) is ServoMove:
+            if script.touched.get(action.board, set()) is not None:
+                script.touched.setdefault(action.board, set()).add(action.servo)
+        elif type(action) is ServoAll:
+            script.touched[action.board] = None
+
+    async def _run_on_worker(self, script, function, *args):
+        future = self.executor.submit(function, *args)
+        script.inflight.add(future)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            if future.done():
+                script.inflight.discard(future)
+
+    def _finish(self, script):
+        if script.safe_stop and script.touched:
+            self.executor.submit(self._quiet, script)
+        else:
+            self._quiet(script)
+
+    def _quiet(self, script):
+        """ Called once nothing the script started is still running """
+        if script.safe_stop:
+            for board, servos in script.touched.items():
+                if __debug__:
+                    print(f"Homing {board} servos {servos or 'all'} after stopping {script.name}")
+                try:
+                    self.dispatch.home(board, servos)
+                except Exception as e:
+                    print(f"Failed to home {board} after stopping {script.name}: {e}")
+        if script.stop_requested is not None:
+            script.stop_latency = time.monotonic() - script.stop_requested
+            self.stop_latencies.append(script.stop_latency)
+        if self.on_finished is not None:
+            self.on_finished(script)
+        script.finished.set()
+
+    async def _run_action(self, script, event):
+        action = event.action
+        if __debug__:
+            print(f"Action: {action}")
+        planned = script.origin + event.time
+        started = self.loop.time()
+        # Claims, releases and priority are handled here rather than on a worker
+        dispatched = started
+        finished = None
+        if type(action) is Claim:
+            waited = self.loop.time()
+            await self._claim(script, action.resources)
+            script.origin += self.loop.time() - waited
+        elif type(action) is Release:
+            self._release(script, action.resources)
+        elif type(action) is Priority:
+            script.priority = action.level
+        else:
+            self._touch(script, action)
+            dispatched, finished = await self._run_on_worker(script, self._dispatch, action)
+            if getattr(action, 'sync', False):
+                script.origin = finished - event.time
+        trace = self.trace
+        if trace is not None:
+            trace.record(script.name, type(action).__name__, planned, started, dispatched,
+                         finished or self.loop.time())
+
+    async def _claim(self, script, resources):
+        """ Take named resources for a script, stopping or waiting for whoever holds them """
+        for resource in resources:
+            while True:
+                held = self.claims.get(resource)
+                if held is None or held[0] is script:
+                    break
+                holder, released = held
+                if script.priority >= holder.priority:
+                    print(f"Script {script.name} takes {resource} from {holder.name}, stopping it")
+                    self._release(holder, [resource])
+                    self.stop_script(holder)
+                    break
+                if __debug__:
+                    print(f"Script {script.name} waiting for {resource} held by {holder.name}")
+                await released.wait()
+            if resource not in script.claims:
+                self.claims[resource] = (script, asyncio.Event())
+                script.claims.add(resource)
+
+    def _release(self, script, resources):
+        for resource in resources:
+            script.claims.discard(resource)
+            held = self.claims.get(resource)
+            if held is not None and held[0] is script:
+                del self.claims[resource]
+                held[1].set()
+
+    def _dispatch(self, action):
+        """ Run an action on a worker, returning when it started and finished in event loop time """
+        dispatched = time.monotonic()
+        self.dispatch.run(action)
+        return dispatched, time.monotonic()
@@ -0,0 +1,78 @@
+""" Optional per-row timing of script playback """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import bisect
+import collections
+import threading
+from builtins import object
+
+# script, action type, then times in seconds: when the row was planned for, when the runtime got to it,
+# when a worker started on it and when it finished
+TraceRecord = collections.namedtuple('TraceRecord', 'script, action, planned, started, dispatched, finished')
+
+# Upper edges of the histogram buckets, in milliseconds
+BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def histogram(values):
+    """ Count of values (seconds) in each of BUCKETS, plus a last count of everything over the top edge """
+    counts = [0] * (len(BUCKETS) + 1)
+    for value in values:
+        counts[bisect.bisect_left(BUCKETS, value * 1000)] += 1
+    return counts
+
+
+class ScriptTrace(object):
+    """
+    Ring buffer of the last size rows played, with histograms of how late
+    each row started, how long it waited for a worker and how long its
+    action took, by script and by action type.
+    """
+
+    def __init__(self, size=4096):
+        self.lock = threading.Lock()
+        self.records = collections.deque(maxlen=size)
+
+    def record(self, script, action, planned, started, dispatched, finished):
+        with self.lock:
+            self.records.append(TraceRecord(script, action, planned, started, dispatched, finished))
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def histograms(self):
+        """ Late, queue and duration histograms of the traced rows, by script and by action type """
+        with self.lock:
+            records = list(self.records)
+        return {'buckets_ms': BUCKETS,
+                'rows': len(records),
+                'scripts': self._group(records, 'script'),
+                'actions': self._group(records, 'action')}
+
+    @staticmethod
+    def _group(records, field):
+        groups = {}
+        for record in records:
+            groups.setdefault(getattr(record, field), []).append(record)
+        return {key: {'count': len(rows),
+                      'late': histogram([r.started - r.planned for r in rows]),
+                      'queue': histogram([r.dispatched - r.started for r in rows]),
+                      'duration': histogram([r.finished - r.dispatched for r in rows])}
+                for key, rows in groups.items()}
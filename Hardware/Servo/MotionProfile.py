@@ -0,0 +1,131 @@
+""" Motion profiles for servo moves """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import math
+import numpy as np
+
+# Fraction of a trapezoidal move spent accelerating (and again decelerating)
+TRAPEZOID_RAMP = 0.25
+
+# Longest move that is planned, in seconds. Every step of a move is held in memory, so this bounds its size
+MAX_DURATION = 600.0
+
+
+def _linear(t):
+    return t
+
+
+def _ease(t):
+    return (1 - np.cos(np.pi * t)) / 2
+
+
+def _trapezoid(t):
+    ramp = TRAPEZOID_RAMP
+    vmax = 1 / (1 - ramp)
+    return np.where(t < ramp, vmax * t * t / (2 * ramp),
+                    np.where(t > 1 - ramp, 1 - vmax * (1 - t) * (1 - t) / (2 * ramp),
+                             vmax * (t - ramp / 2)))
+
+
+def _scurve(t):
+    # Minimum jerk: zero velocity and acceleration at both ends
+    return t * t * t * (10 - 15 * t + 6 * t * t)
+
+
+profiles = {'linear': _linear,
+            'ease': _ease,
+            'trapezoid': _trapezoid,
+            'scurve': _scurve}
+
+
+def trajectory(start, end, duration, step, profile='linear'):
+    """
+    PWM value for every step of a move, index n is the value at start + n * step
+
+    Parameters
+    ----------
+    start : int
+         PWM value at the start of the move
+    end : int
+         PWM value at the end of the move
+    duration : float
+         Length of the move in seconds
+    step : float
+         Time between steps in seconds
+    profile : str
+         One of the names in profiles, moves longer than MAX_DURATION are cut to it
+    """
+    if duration <= 0:
+        return np.array([end], dtype=np.int32)
+    duration = min(duration, MAX_DURATION)
+    curve = profiles.get(profile)
+    if curve is None:
+        print(f"Unknown motion profile ({profile}), using linear")
+        curve = _linear
+    steps = int(math.ceil(duration / step))
+    t = np.minimum(np.arange(steps + 1) * step / duration, 1.0)
+    return np.rint(start + (end - start) * curve(t)).astype(np.int32)
+
+
+def blend(start, velocity, end, duration, step, max_velocity=0, max_accel=0):
+    """
+    PWM value for every step of a move that starts already moving
+
+    Rather than restarting from rest, the move carries on from the current
+    velocity and steers towards end, aiming to arrive after duration but
+    never exceeding max_velocity (PWM/s) or max_accel (PWM/s/s). A limit of
+    0 means unlimited. The move takes longer than duration if the limits
+    need it to.
+
+    Parameters
+    ----------
+    start : int
+         PWM value at the start of the move
+    velocity : float
+         Velocity (PWM/s) at the start of the move
+    end : int
+         PWM value to finish at
+    duration : float
+         Requested length of the move in seconds
+    step : float
+         Time between steps in seconds, a duration over MAX_DURATION is cut to it
+    """
+    vmax = max_velocity or math.inf
+    amax = max_accel or math.inf
+    dv_max = amax * step
+    target_steps = int(math.ceil(min(duration, MAX_DURATION) / step))
+    # Never plan more than a minute of steps, even with very low limits
+    max_steps = target_steps + int(60 / step)
+    position = float(start)
+    values = [start]
+    for k in range(1, max_steps):
+        distance = end - position
+        if abs(distance) < 0.5 and abs(velocity) <= dv_max:
+            break
+        direction = math.copysign(1, distance)
+        wanted = distance / (max(target_steps - k + 1, 1) * step)
+        wanted = direction * min(abs(wanted), vmax, math.sqrt(2 * amax * abs(distance)))
+        velocity += max(-dv_max, min(dv_max, wanted - velocity))
+        position += velocity * step
+        if math.copysign(1, end - position) != direction:
+            position = end
+            velocity = 0.0
+        values.append(int(round(position)))
+    values.append(end)
+    return np.array(values, dtype=np.int32)
@@ -0,0 +1,180 @@
+""" Shared PCA9685 board access with batched channel writes """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import threading
+from builtins import object
+from future import standard_library
+standard_library.install_aliases()
+
+# Registers
+MODE1 = 0x00
+LED0_ON_L = 0x06
+# MODE1 bits
+AI = 0x20
+
+CHANNELS = 16
+# An SMBus block write carries at most 32 bytes, which is 8 channels of LEDn_ON/OFF
+MAX_BLOCK_CHANNELS = 8
+
+_devices = {}
+_devices_lock = threading.Lock()
+# One lock per board, so different boards can be opened at the same time
+_open_locks = {}
+
+
+def _open_pca9685(address, busnum):
+    import Adafruit_PCA9685
+    return Adafruit_PCA9685.PCA9685(address=int(address, 16), busnum=int(busnum))
+
+
+def _open_simulated(address, busnum):
+    from .SimulatedPCA9685 import SimulatedPCA9685
+    return SimulatedPCA9685(address=int(address, 16))
+
+
+# Drivers that can sit behind a PCA9685Device, selected by the backend option in servo_<name>.cfg
+backends = {'pca9685': _open_pca9685,
+            'simulated': _open_simulated}
+
+
+def get_device(address, busnum=1, frequency=60, backend='pca9685'):
+    """
+    Return the shared handle for a board, opening and configuring it on first use
+
+    Every servo on the same address gets the same PCA9685Device, so each
+    board is only reset and has its frequency set once.
+
+    Parameters
+    ----------
+    address : str
+         i2c address of the board, as a hex string
+    busnum : int
+         i2c bus the board is on
+    frequency : int
+         PWM frequency to configure the board with
+    backend : str
+         Name of the driver in backends to open the board with
+    """
+    key = (int(busnum), int(address, 16))
+    with _devices_lock:
+        open_lock = _open_locks.setdefault(key, threading.Lock())
+    with open_lock:
+        device = _devices.get(key)
+        if device is None:
+            if __debug__:
+                print(f"Opening PCA9685 at {address} on bus {busnum}")
+            device = PCA9685Device(address, busnum, frequency, backend)
+            _devices[key] = device
+        elif device.frequency != frequency:
+            print(f"PCA9685 at {address} already running at {device.frequency}Hz, ignoring {frequency}Hz")
+    return device
+
+
+class PCA9685Device(object):
+    """
+    Wrapper around an Adafruit PCA9685 that can update many channels in a
+    single i2c transaction. Register auto-increment is enabled so that a run
+    of channels is sent as one block write to consecutive LEDn_ON/OFF
+    registers. A shadow copy of each channel's last value is kept, so
+    channels that have not changed are not sent again and small gaps in a
+    run can be filled in rather than split into more writes.
+
+    Use get_device() rather than creating these directly. All access to the
+    board goes through lock, so the handle is safe to share between threads.
+    """
+
+    def __init__(self, address, busnum=1, frequency=60, backend='pca9685'):
+        self.address = address
+        self.frequency = frequency
+        self.backend = backend
+        self.lock = threading.RLock()
+        if backend not in backends:
+            raise ValueError(f"Unknown servo backend ({backend})")
+        self.i2c = backends[backend](address, busnum)
+        self.i2c.set_pwm_freq(frequency)
+        self._device = self.i2c._device
+        mode1 = self._device.readU8(MODE1)
+        self._device.write8(MODE1, mode1 | AI)
+        # The Adafruit driver sets every channel to 0, 0 when it opens the board
+        self.shadow = [(0, 0)] * CHANNELS
+        self.writes = 0
+        self.suppressed = 0
+        self.transactions = 0
+
+    def write_channels(self, values):
+        """
+        Write a set of channels using as few block writes as possible,
+        skipping any channel whose value has not changed
+
+        Parameters
+        ----------
+        values : dict
+             channel -> (on, off) of every channel to update
+        """
+        with self.lock:
+            changed = {}
+            for channel, value in values.items():
+                if self.shadow[channel] == value:
+                    self.suppressed += 1
+                else:
+                    changed[channel] = value
+            self.writes += len(changed)
+            for start, run in self._runs(changed):
+                data = []
+                for on, off in run:
+                    data += [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+                self._device.writeList(LED0_ON_L + 4 * start, data)
+                self.transactions += 1
+                for idx, value in enumerate(run):
+                    self.shadow[start + idx] = value
+
+    def stats(self):
+        """ Channel writes issued and suppressed, and i2c transactions used, since the board was opened """
+        return {'address': self.address,
+                'backend': self.backend,
+                'writes': self.writes,
+                'suppressed': self.suppressed,
+                'transactions': self.transactions}
+
+    def _runs(self, values):
+        """ Split the channels into runs of consecutive registers, filling gaps from the shadow """
+        runs = []
+        start = None
+        run = []
+        for channel in range(CHANNELS):
+            if channel in values:
+                value = values[channel]
+            elif run and any(c in values for c in range(channel + 1, start + MAX_BLOCK_CHANNELS)):
+                value = self.shadow[channel]
+            else:
+                if run:
+                    runs.append((start, run))
+                start = None
+                run = []
+                continue
+            if start is None:
+                start = channel
+            run.append(value)
+            if len(run) == MAX_BLOCK_CHANNELS:
+                runs.append((start, run))
+                start = None
+                run = []
+        if run:
+            runs.append((start, run))
+        return runs
@@ -0,0 +1,304 @@
+"""
+Benchmarks for the servo engine, run against simulated PCA9685 boards
+
+Drive ServoControl through realistic loads on simulated boards and report
+command to first write latency, tick jitter, CPU per servo and i2c traffic.
+
+Run from the top of the repository, without any hardware:
+
+    R2_CONFIG_DIR=/tmp/r2_config/ python3 -O -m Hardware.Servo.ServoBenchmark
+
+Loads:
+    open_close  - open and close every servo on every board
+    scripts     - replay the dome choreographies in scripts/*dome*.scr
+    storm       - several threads sending random slider positions as fast as they can
+"""
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import argparse
+import bisect
+import csv
+import glob
+import os
+import random
+import tempfile
+import threading
+import time
+import numpy as np
+from .ServoControl import ServoControl
+from .PCA9685Device import LED0_ON_L, CHANNELS
+
+_scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts')
+
+BOARDS = [('bench_dome', '0x60'), ('bench_body', '0x61')]
+
+
+def percentile(values, pct):
+    """ pct percentile of values, None if there are none """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def _dome_scripts():
+    scripts = {}
+    for path in sorted(glob.glob(os.path.join(_scripts_dir, '*dome*.scr'))):
+        with open(path, 'rt', encoding='utf-8') as ifile:
+            scripts[os.path.basename(path)[:-4]] = [row for row in csv.reader(ifile) if row]
+    return scripts
+
+
+class ServoBenchmark(object):
+    """ A set of simulated boards and ServoControls to run loads against """
+
+    def __init__(self, servos=32, tick_rate=200, speed=1.0):
+        self.speed = speed
+        self.tick = 1.0 / tick_rate
+        self.scripts = _dome_scripts()
+        self.config_dir = tempfile.mkdtemp(prefix='servo_bench_') + '/'
+        per_board = min(CHANNELS, max(1, servos // len(BOARDS)))
+        script_servos = sorted(set(row[1] for rows in self.scripts.values() for row in rows
+                                   if row[0] == 'dome' and row[1] != 'all'))
+        for board, address in BOARDS:
+            names = script_servos if board == 'bench_dome' else []
+            names = (names + [f"{board}_{n}" for n in range(per_board)])[:per_board]
+            with open(self.config_dir + 'servo_' + board + '.cfg', 'wt', encoding='utf-8') as cfg:
+                cfg.write(f"[DEFAULT]\naddress = {address}\nbackend = simulated\ntick_rate = {tick_rate}\n")
+            with open(self.config_dir + 'servo_' + board + '_list.cfg', 'wt', encoding='utf-8') as cfg:
+                for channel, name in enumerate(names):
+                    cfg.write(f"{channel},{name},300,500,300\n")
+        self.boards = {board: ServoControl(board, self.config_dir) for board, address in BOARDS}
+        self.servo_count = sum(len(control.servos) for control in self.boards.values())
+        self.commands = []
+        self.commands_lock = threading.Lock()
+        # (board, channel) -> (started, change) for every move the scheduler started on that channel, where change
+        # is how far into the move its first change to the channel is planned, None if it changes nothing
+        self.starts = {}
+        for board, control in self.boards.items():
+            for servo in control.servos.values():
+                self._watch(board, control.scheduler.channels[servo.channel])
+
+    def _watch(self, board, channel):
+        """ Note when the scheduler starts each move on a channel """
+        start_move = channel.start_move
+
+        def watched(*args, **kwargs):
+            started = time.monotonic()
+            start_move(*args, **kwargs)
+            on, off = self._device(board).shadow[channel.Channel]
+            changes = np.flatnonzero(channel.trajectory != off) if on == 0 else [0]
+            change = changes[0] * channel.step if len(changes) else None
+            self.starts.setdefault((board, channel.Channel), []).append((started, change))
+        channel.start_move = watched
+
+    def _record(self, board, servo):
+        with self.commands_lock:
+            self.commands.append((time.monotonic(), board, servo.channel))
+
+    def move(self, board, servo_name, position, duration):
+        control = self.boards[board]
+        servo = control.servos.get(servo_name)
+        if servo is None:
+            return
+        self._record(board, servo)
+        control.servo_command(servo_name, position, duration)
+
+    def move_all(self, board, position, duration):
+        control = self.boards[board]
+        for servo in control.servos.values():
+            self._record(board, servo)
+        if position:
+            control.open_all_servos(duration)
+        else:
+            control.close_all_servos(duration)
+
+    def wait_idle(self, timeout=30):
+        """ Wait until every board has finished moving and released its servos """
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            busy = False
+            for control in self.boards.values():
+                scheduler = control.scheduler
+                if scheduler.deadlines or scheduler.release_slots or \
+                        any(servo.state.pending for servo in control.servos.values()):
+                    busy = True
+            if not busy:
+                return
+            time.sleep(0.01)
+
+    def _device(self, board):
+        return self.boards[board].scheduler.i2c
+
+    def load_open_close(self, repeats=5):
+        for i in range(repeats):
+            for board in self.boards:
+                self.move_all(board, 1, 1)
+            self.wait_idle()
+            for board in self.boards:
+                self.move_all(board, 0, 1)
+            self.wait_idle()
+
+    def load_scripts(self):
+        for name, rows in self.scripts.items():
+            for row in rows:
+                if row[0] == 'sleep':
+                    if row[1] != 'random':
+                        time.sleep(float(row[1]) / self.speed)
+                elif row[0] == 'dome':
+                    if row[1] == 'all':
+                        self.move_all('bench_dome', 1 if row[2] == 'open' else 0, 0)
+                    else:
+                        self.move('bench_dome', row[1], float(row[2]), int(row[3]))
+            self.wait_idle()
+
+    def load_storm(self, threads=4, count=2000):
+        def storm(seed):
+            rand = random.Random(seed)
+            for i in range(count):
+                board = rand.choice(list(self.boards))
+                servo_name = rand.choice(list(self.boards[board].servos))
+                self.move(board, servo_name, rand.random(), rand.choice([0, 0, 1]))
+        workers = [threading.Thread(target=storm, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.wait_idle()
+
+    def run(self, name, load, **kwargs):
+        """ Run a load and return its measurements """
+        self.wait_idle()
+        for board in self.boards:
+            self._device(board).i2c._device.reset()
+        self.commands = []
+        self.starts = {}
+        before = {board: control.board_stats() for board, control in self.boards.items()}
+        cpu = time.process_time()
+        start = time.monotonic()
+        load(**kwargs)
+        wall = time.monotonic() - start
+        cpu = time.process_time() - cpu
+        after = {board: control.board_stats() for board, control in self.boards.items()}
+        transactions = {board: self._device(board).i2c._device.transactions for board in self.boards}
+        latency, superseded = self._latency(transactions)
+        jitter = self._jitter(transactions)
+        return {'load': name,
+                'commands': len(self.commands),
+                'superseded': superseded,
+                'latency_p50': percentile(latency, 50),
+                'latency_p99': percentile(latency, 99),
+                'jitter_p50': percentile(jitter, 50),
+                'jitter_p99': percentile(jitter, 99),
+                'cpu_per_servo': 100.0 * cpu / wall / self.servo_count,
+                'transactions_per_sec': sum(after[b]['transactions'] - before[b]['transactions']
+                                            for b in self.boards) / wall,
+                'writes_per_sec': sum(after[b]['writes'] - before[b]['writes'] for b in self.boards) / wall,
+                'suppressed': sum(after[b]['suppressed'] - before[b]['suppressed'] for b in self.boards),
+                'dropped': sum(after[b]['dropped'] - before[b]['dropped'] for b in self.boards),
+                'wall': wall}
+
+    def _latency(self, transactions):
+        """
+        Seconds from each command to the first write of its move, and how many were superseded
+
+        Each command is matched to the first move the scheduler started on its channel after
+        it, and then to the first write to the channel after that move started. A slow move
+        may not change the PWM value for several ticks, so the time the move itself planned
+        before its first change is not counted. A move that writes nothing before it ends or
+        is replaced, such as one to where the servo already is, is measured to when it started.
+        """
+        writes = {}
+        for board, txs in transactions.items():
+            for tx in txs:
+                first = (tx.register - LED0_ON_L) // 4
+                last = (tx.register + len(tx.data) - 1 - LED0_ON_L) // 4
+                for channel in range(max(first, 0), min(last, CHANNELS - 1) + 1):
+                    writes.setdefault((board, channel), []).append(tx.time)
+        starts = {key: [started for started, change in moves] for key, moves in self.starts.items()}
+        following = {}
+        latency = []
+        superseded = 0
+        for sent, board, channel in sorted(self.commands, reverse=True):
+            key = (board, channel)
+            times = starts.get(key, [])
+            idx = bisect.bisect_left(times, sent)
+            next_command = following.get(key)
+            following[key] = sent
+            if idx >= len(times) or (next_command is not None and times[idx] >= next_command):
+                superseded += 1
+                continue
+            started, change = self.starts[key][idx]
+            replaced = times[idx + 1] if idx + 1 < len(times) else None
+            written = writes.get(key, [])
+            idx = bisect.bisect_left(written, started)
+            if change is None or idx >= len(written) or (replaced is not None and written[idx] >= replaced):
+                latency.append(started - sent)
+            else:
+                latency.append(written[idx] - change - sent)
+        return latency, superseded
+
+    def _jitter(self, transactions):
+        """ Seconds each tick was away from the tick rate while boards were moving """
+        jitter = []
+        for txs in transactions.values():
+            ticks = []
+            for tx in txs:
+                if not ticks or tx.time - ticks[-1] > self.tick / 4:
+                    ticks.append(tx.time)
+            for prev, cur in zip(ticks, ticks[1:]):
+                if cur - prev < 1.5 * self.tick:
+                    jitter.append(abs(cur - prev - self.tick))
+        return jitter
+
+
+def _ms(value):
+    return "    -  " if value is None else "%7.2f" % (value * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the servo engine on simulated boards')
+    parser.add_argument('--servos', type=int, default=32, help='servos across both boards (max 32)')
+    parser.add_argument('--tick-rate', type=float, default=200, help='step rate of every servo')
+    parser.add_argument('--speed', type=float, default=1.0, help='speed up script sleeps by this factor')
+    parser.add_argument('--storm-threads', type=int, default=4)
+    parser.add_argument('--storm-commands', type=int, default=2000, help='commands sent by each storm thread')
+    parser.add_argument('--loads', default='open_close,scripts,storm')
+    args = parser.parse_args()
+
+    bench = ServoBenchmark(args.servos, args.tick_rate, args.speed)
+    loads = {'open_close': (bench.load_open_close, {}),
+             'scripts': (bench.load_scripts, {}),
+             'storm': (bench.load_storm, {'threads': args.storm_threads, 'count': args.storm_commands})}
+    results = []
+    for name in args.loads.split(','):
+        load, kwargs = loads[name]
+        results.append(bench.run(name, load, **kwargs))
+
+    print(f"\n{bench.servo_count} servos, {args.tick_rate:g}Hz tick")
+    print("load        commands  lat p50  lat p99  jit p50  jit p99  cpu/servo  i2c tx/s  writes/s  dropped")
+    print("                        (ms)     (ms)     (ms)     (ms)     (%)")
+    for r in results:
+        print(f"{r['load']:<10} {r['commands']:>9} {_ms(r['latency_p50'])}  {_ms(r['latency_p99'])}  "
+              f"{_ms(r['jitter_p50'])}  {_ms(r['jitter_p99'])}  {r['cpu_per_servo']:9.3f}  "
+              f"{r['transactions_per_sec']:8.0f}  {r['writes_per_sec']:8.0f}  {r['dropped']:7}")
+
+
+if __name__ == '__main__':
+    main()
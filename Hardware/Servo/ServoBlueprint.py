@@ -21,16 +21,16 @@
 from __future__ import print_function
 from __future__ import absolute_import
 from future import standard_library
-from flask import Blueprint, request
-from .ServoControl import ServoControl
+from flask import Blueprint, request, jsonify
+from .ServoControl import ServoControl, group_move
 standard_library.install_aliases()
 
 
-def construct_blueprint(name):
+def construct_blueprint(name, servo=None):
 
     api = Blueprint('servo_' + name, __name__)
 
-    _servo = ServoControl(name)
+    _servo = servo or ServoControl(name)
 
     @api.route('/', methods=['GET'])
     @api.route('/list', methods=['GET'])
@@ -41,12 +41,64 @@ def construct_blueprint(name):
             message += _servo.list_servos()
         return message
 
+    @api.route('/state', methods=['GET'])
+    def _servo_state():
+        """GET a JSON object of every servo's current PWM, target and move progress"""
+        if request.method == 'GET':
+            return jsonify(_servo.servo_state())
+        return "Fail"
+
+    @api.route('/state/<servo_name>', methods=['GET'])
+    def _servo_state_single(servo_name):
+        """GET a JSON object of a single servo's current PWM, target and move progress"""
+        if request.method == 'GET':
+            return jsonify(_servo.servo_state(servo_name))
+        return "Fail"
+
+    @api.route('/stats', methods=['GET'])
+    def _servo_stats():
+        """GET a JSON object of PWM writes issued and suppressed, and i2c transactions, for the board"""
+        if request.method == 'GET':
+            return jsonify(_servo.board_stats())
+        return "Fail"
+
+    @api.route('/group', methods=['POST'])
+    def _servo_group():
+        """POST a JSON list of {servo, position, duration, offset, board} moves to start together"""
+        message = ""
+        if request.method == 'POST':
+            try:
+                moves = [(move.get('board', name), move['servo'], move['position'],
+                          move.get('duration', 0), move.get('offset', 0))
+                         for move in request.get_json(force=True)]
+            except Exception:
+                return "Fail"
+            message += group_move(moves)
+        return message
+
     @api.route('/<servo_name>/<servo_position>/<servo_duration>', methods=['GET'])
     def _servo_move(servo_name, servo_position, servo_duration):
         """GET will move a selected servo to the required position over a set duration"""
+        message = ""
+        if request.method == 'GET':
+            message += _servo.servo_command(servo_name, servo_position, servo_duration)
+        return message
+
+    @api.route('/<servo_name>/<servo_position>/<servo_duration>/<profile>', methods=['GET'])
+    def _servo_move_profile(servo_name, servo_position, servo_duration, profile):
+        """GET will move a selected servo to the required position over a set duration using a motion profile"""
+        message = ""
         if request.method == 'GET':
-            _servo.servo_command(servo_name, servo_position, servo_duration)
-        return "Ok"
+            message += _servo.servo_command(servo_name, servo_position, servo_duration, profile)
+        return message
+
+    @api.route('/home', methods=['GET'])
+    def _servo_home():
+        """GET to send all servos to their home positions"""
+        if request.method == 'GET':
+            _servo.home_all_servos()
+            return "Ok"
+        return "Fail"
 
     @api.route('/close/<duration>', methods=['GET'])
     def _servo_close_slow(duration):
@@ -18,11 +18,12 @@
 # along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
 # ===============================================================================
 
-from .ServoThread import ServoThread
-from queue import Queue
+from .ServoScheduler import get_scheduler
+from . import MotionProfile
 import csv
 import collections
 import os
+import time
 from pathlib import Path
 import configparser
 from builtins import object
@@ -32,20 +33,78 @@ standard_library.install_aliases()
 
 _configdir = mainconfig.mainconfig['config_dir']
 
+# Group moves start this long after the request, so every board has its commands before the first tick
+GROUP_LEAD = 0.02
+
+# Every ServoControl, keyed by board name
+_boards = {}
+
+
+def group_move(moves):
+    """
+    Start a set of moves on a common tick across every servo board
+
+    Parameters
+    ----------
+    moves : list
+         (board, servo, position, duration, offset) tuples. position is 0 to 1,
+         duration and offset are in seconds, offset being from the common start,
+         and each is 0 to MotionProfile.MAX_DURATION. Nothing is moved if any is bad
+    """
+    commands = []
+    for board, servo_name, position, duration, offset in moves:
+        control = _boards.get(board)
+        if control is None or control.scheduler is None:
+            print(f"Unknown servo board ({board})")
+            return "Unknown board"
+        servo = control.servos.get(servo_name)
+        if servo is None:
+            print(f"Unknown servo ({board}/{servo_name})")
+            return "Unknown servo"
+        try:
+            position, duration, offset = float(position), float(duration), float(offset)
+        except Exception:
+            print(f"Bad group move ({board}/{servo_name}: {position}, {duration}, {offset})")
+            return "Fail"
+        # float() accepts nan and inf, which would never finish or would never start
+        if not 0 <= duration <= MotionProfile.MAX_DURATION or not 0 <= offset <= MotionProfile.MAX_DURATION:
+            print(f"Invalid group move timing ({board}/{servo_name}: {duration}, {offset})")
+            return "Fail"
+        if not 0 <= position <= 1:
+            print(f"Invalid position ({board}/{servo_name}: {position})")
+            return "Fail"
+        commands.append((control, servo, position, duration, offset))
+    if __debug__:
+        print(f"Group move of {len(commands)} servos")
+    start = time.monotonic() + GROUP_LEAD
+    for control, servo, position, duration, offset in commands:
+        control.scheduler.command(servo.channel, position, duration, None, start + offset)
+    return "Ok"
+
 
 class ServoControl(object):
     """
     Main servo control class. This is used for each adafruit 16 channel
-    pwm modules (or clones). The class will create a thread for each
-    channel configured, and an associated queue to pass commands via.
+    pwm modules (or clones). Every channel configured is registered with
+    the motion scheduler for the board, which commands are passed to.
     """
 
-    Servo = collections.namedtuple('Servo', 'name, queue, thread')
+    Servo = collections.namedtuple('Servo', 'name, channel, state')
 
     def init_config(self, name):
         """
         Load in CSV of Servo definitions
 
+        Each row is channel,name,min,max,home[,rate[,profile[,max_velocity,max_accel[,hold]]]]
+        where the optional rate is the number of interpolation steps per
+        second while the servo is moving (defaults to tick_rate from the
+        servo config), profile is the default motion profile for its moves
+        (linear, ease, trapezoid or scurve, defaults to profile from the
+        servo config), max_velocity (PWM/s) and max_accel (PWM/s/s) limit
+        how a new target is blended into a move already in progress and hold
+        is how long (seconds) to keep driving the servo after a move before
+        powering it down (defaults to hold from the servo config).
+
         Parameters
         ----------
         address : int
@@ -54,8 +113,14 @@ class ServoControl(object):
              location of the config file containing servo details
         """
 
-        list_file = Path(_configdir + 'servo_' + name + '_list.cfg')
+        list_file = Path(self.config_dir + 'servo_' + name + '_list.cfg')
         list_file.touch(exist_ok=True)
+        try:
+            self.scheduler = get_scheduler(self.address, self.tick_rate, self.mailbox, self.backend,
+                                           self.release_window)
+        except Exception as e:
+            print(f"Oops: {e}")
+            return
         ifile = open(list_file, "rt")
         reader = csv.reader(ifile)
         for row in reader:
@@ -65,28 +130,47 @@ class ServoControl(object):
                 servo_Min = int(row[2])
                 servo_Max = int(row[3])
                 servo_home = int(row[4])
-                queue = Queue()
-                try:
-                    self.servo_list.append(self.Servo(name=servo_name, queue=queue,
-                                                      thread=ServoThread(self.address, servo_Max, servo_Min, servo_home,
-                                                                         servo_channel, queue)))
-                    for servo in self.servo_list:
-                        if servo.name == servo_name:
-                            servo.thread.daemon = True
-                            servo.thread.start()
-                except Exception as e:
-                    print(f"Oops: {e}")
+                servo_rate = None
+                if len(row) > 5 and row[5] != "":
+                    servo_rate = float(row[5])
+                servo_profile = self.profile
+                if len(row) > 6 and row[6] != "":
+                    servo_profile = row[6]
+                servo_max_velocity = 0
+                if len(row) > 7 and row[7] != "":
+                    servo_max_velocity = float(row[7])
+                servo_max_accel = 0
+                if len(row) > 8 and row[8] != "":
+                    servo_max_accel = float(row[8])
+                servo_hold = self.hold
+                if len(row) > 9 and row[9] != "":
+                    servo_hold = float(row[9])
+                state = self.scheduler.add_channel(servo_channel, servo_Max, servo_Min, servo_home,
+                                                   servo_rate, servo_profile, servo_max_velocity, servo_max_accel,
+                                                   servo_hold)
+                self.servos[servo_name] = self.Servo(name=servo_name, channel=servo_channel, state=state)
                 if __debug__:
                     print(f"Added servo: {servo_channel} {servo_name} {servo_Min} {servo_Max} {servo_home}")
         ifile.close()
-        self.close_all_servos(0)
+        self.home_all_servos()
 
-    def __init__(self, name):
-        self.servo_list = []
+    def __init__(self, name, config_dir=None):
+        self.name = name
+        self.servos = {}
+        self.scheduler = None
+        self.config_dir = config_dir or _configdir
 
-        _configfile = mainconfig.mainconfig['config_dir'] + 'servo_' + name + '.cfg'
+        _configfile = self.config_dir + 'servo_' + name + '.cfg'
         _config = configparser.SafeConfigParser({'address': '0x40',
-                                                'logfile': 'servo_' + name + '.log'})
+                                                'logfile': 'servo_' + name + '.log',
+                                                'tick_rate': '200',
+                                                'mailbox': 'true',
+                                                'profile': 'linear',
+                                                'backend': 'pca9685',
+                                                'hold': '0.2',
+                                                'release_window': '0.05',
+                                                'home_batch': '4',
+                                                'home_stagger': '0.02'})
         _config.read(_configfile)
 
         if not os.path.isfile(_configfile):
@@ -100,7 +184,16 @@ class ServoControl(object):
         # _logfile = _defaults['logfile']
 
         self.address = _defaults['address']
+        self.tick_rate = float(_defaults['tick_rate'])
+        self.mailbox = _config.getboolean('DEFAULT', 'mailbox')
+        self.profile = _defaults['profile']
+        self.backend = _defaults['backend']
+        self.hold = float(_defaults['hold'])
+        self.release_window = float(_defaults['release_window'])
+        self.home_batch = int(_defaults['home_batch'])
+        self.home_stagger = float(_defaults['home_stagger'])
         self.init_config(name)
+        _boards[name] = self
         if __debug__:
             print(f"Initialised servo module {name} at address {self.address}")
 
@@ -109,10 +202,48 @@ class ServoControl(object):
         message = ""
         if __debug__:
             print(f"Listing servos for address: {self.address}")
-        for servo in self.servo_list:
-            message += "%s\n" % servo.name
+        for servo in self.servos:
+            message += "%s\n" % servo
         return message
 
+    def servo_state(self, servo_name=None):
+        """ Current state of every servo, or just the named one, keyed by name """
+        if servo_name is not None:
+            if servo_name not in self.servos:
+                return {}
+            return {servo_name: self.servos[servo_name].state.state()}
+        return {name: servo.state.state() for name, servo in self.servos.items()}
+
+    def board_stats(self):
+        """ Write counters for the board and the number of commands dropped by the mailboxes """
+        if self.scheduler is None:
+            return {}
+        stats = self.scheduler.i2c.stats()
+        stats['dropped'] = sum(servo.state.dropped for servo in self.servos.values())
+        return stats
+
+    def group_move(self, moves):
+        """ Start a set of (servo, position, duration, offset) moves on this board together """
+        return group_move([(self.name,) + tuple(move) for move in moves])
+
+    def home_all_servos(self):
+        """ Send every servo to its home position, home_batch servos at a time """
+        if __debug__:
+            print("Homing all servos")
+        self.home_servos()
+        return
+
+    def home_servos(self, servo_names=None):
+        """ Send the named servos, or every servo if None, to their home positions """
+        if self.scheduler is None:
+            print(f"No servo board for {self.name}, not homing")
+            return
+        if servo_names is None:
+            servo_names = self.servos
+        channels = sorted(self.servos[name].channel for name in servo_names if name in self.servos)
+        self.scheduler.home(channels, self.home_batch, self.home_stagger)
+        return
+
     def close_all_servos(self, duration):
         """ Close all servos """
         try:
@@ -120,10 +251,13 @@ class ServoControl(object):
         except Exception:
             print("Duration is not an int")
             duration = 0
+        if duration > MotionProfile.MAX_DURATION:
+            print(f"Invalid duration ({duration})")
+            return
         if __debug__:
             print("Closing all servos")
-        for servo in self.servo_list:
-            servo.queue.put([0, duration])
+        for servo in self.servos.values():
+            self.scheduler.command(servo.channel, 0, duration)
         return
 
     def open_all_servos(self, duration):
@@ -133,31 +267,46 @@ class ServoControl(object):
         except Exception:
             print("Duration is not an int")
             duration = 0
+        if duration > MotionProfile.MAX_DURATION:
+            print(f"Invalid duration ({duration})")
+            return
         if __debug__:
             print("Opening all servos")
-        for servo in self.servo_list:
-            servo.queue.put([1, duration])
+        for servo in self.servos.values():
+            self.scheduler.command(servo.channel, 1, duration)
         return
 
     # Send a command over i2c to turn a servo to a given position (percentage) over a set duration (seconds)
     # def servo_command(self, servo_name, position, duration):
-    def servo_command(self, servo_name, position, duration):
-        """ Send command to a servo """
+    def servo_command(self, servo_name, position, duration, profile=None):
+        """ Send command to a servo, optionally overriding its motion profile """
         if __debug__:
             print(f"Moving {servo_name} to {position} over duration {duration}")
-        current_servo = []
+        current_servo = self.servos.get(servo_name)
+        if current_servo is None:
+            print(f"Unknown servo ({servo_name})")
+            return "Unknown servo"
         try:
             position = float(position)
         except Exception:
             print("Position not a float")
+            return "Fail"
+        if not 0 <= position <= 1:
+            print(f"Invalid position ({position})")
+            return "Fail"
         try:
             duration = int(duration)
         except Exception:
             print("Duration is not an int")
-        for servo in self.servo_list:
-            if servo.name == servo_name:
-                current_servo = servo
-        current_servo.queue.put([position, duration])
+            duration = 0
+        if duration > MotionProfile.MAX_DURATION:
+            print(f"Invalid duration ({duration})")
+            return "Fail"
+        if profile is not None and profile not in MotionProfile.profiles:
+            print(f"Unknown motion profile ({profile})")
+            return "Fail"
+        self.scheduler.command(current_servo.channel, position, duration, profile)
+        return "Ok"
 
 
 # servo = _ServoControl("body")
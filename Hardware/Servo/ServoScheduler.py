@@ -0,0 +1,383 @@
+""" Motion scheduler for each PCA9685 board """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import threading
+import time
+import heapq
+import math
+import collections
+from queue import Queue, Empty
+from builtins import object
+from .PCA9685Device import get_device
+from . import MotionProfile
+from future import standard_library
+standard_library.install_aliases()
+
+# Default time (seconds) to keep driving a servo after it reaches its destination
+RELEASE_DELAY = 0.2
+# Default width (seconds) of the release slots servos are powered down in together
+RELEASE_WINDOW = 0.05
+# Generation used on the deadline heap for a command waiting for its start time
+STARTING = -1
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+# One lock per board, so different boards can be brought up at the same time
+_start_locks = {}
+
+
+def get_scheduler(address, tick_rate, mailbox=True, backend='pca9685', release_window=RELEASE_WINDOW):
+    """
+    Return the scheduler for a board, starting it on first use
+
+    Parameters
+    ----------
+    address : str
+         i2c address of the board, as a hex string
+    tick_rate : float
+         Default number of interpolation steps per second while a move is in flight
+    mailbox : bool
+         Only keep the latest command waiting for each channel
+    backend : str
+         Driver to open the board with, see PCA9685Device.backends
+    release_window : float
+         Servos due to be released within this many seconds of each other are powered down together
+    """
+    with _schedulers_lock:
+        start_lock = _start_locks.setdefault(address, threading.Lock())
+    with start_lock:
+        scheduler = _schedulers.get(address)
+        if scheduler is None:
+            scheduler = ServoScheduler(address, tick_rate, mailbox, backend, release_window)
+            scheduler.daemon = True
+            scheduler.start()
+            _schedulers[address] = scheduler
+    return scheduler
+
+
+class ServoChannel(object):
+    """ Interpolation state for a single servo channel """
+
+    def __init__(self, channel, Max, Min, Home, rate, mailbox=True, profile='linear',
+                 max_velocity=0, max_accel=0, hold=RELEASE_DELAY):
+        self.Channel = channel
+        self.Max = Max
+        self.Min = Min
+        self.Home = Home
+        self.current_position = Home
+        self.original_position = Home
+        self.destination_position = Home
+        self.destination_start = 0
+        self.destination_time = 0
+        self.processing = False
+        self.step = 1.0 / float(rate)
+        self.profile = profile
+        # Limits (PWM/s and PWM/s/s) used when a new target arrives mid-move, 0 is unlimited
+        self.max_velocity = max_velocity
+        self.max_accel = max_accel
+        self.trajectory = MotionProfile.trajectory(Home, Home, 0, self.step)
+        # Time to keep driving the servo after a move, and the release slot it is waiting in
+        self.hold = hold
+        self.release_slot = None
+        # Bumped whenever the channel is rescheduled, older heap entries are then ignored
+        self.generation = 0
+        # Commands waiting to start. In mailbox mode only the latest is kept.
+        self.mailbox = mailbox
+        self.pending = collections.deque()
+        self.dropped = 0
+        self.last_command = None
+        # Start time of the pending command already on the deadline heap
+        self.waiting_for = None
+
+    def start_move(self, position, duration, now, profile=None):
+        """
+        Begin a move from the current position, position is 0 to 1 of the full
+        swing or None to go to the servo's home position
+
+        The PWM value for every step of the move is worked out here, so
+        stepping is just a lookup into trajectory. If the channel is already
+        moving and has velocity or acceleration limits, the new target is
+        blended into the current motion instead of starting again from rest.
+        """
+        if position is not None and (position > 1 or position < 0):
+            print(f"Invalid position ({position})")
+            return
+        velocity = self.velocity_at(now)
+        if position is None:
+            self.destination_position = self.Home
+            self.processing = True
+        else:
+            self.destination_position = int(((self.Max - self.Min) * position) + self.Min)
+            self.processing = True
+        self.destination_start = now
+        self.original_position = self.current_position
+        self.release_slot = None
+        if velocity and (self.max_velocity or self.max_accel):
+            self.trajectory = MotionProfile.blend(self.original_position, velocity, self.destination_position,
+                                                  duration, self.step, self.max_velocity, self.max_accel)
+            duration = (len(self.trajectory) - 1) * self.step
+        else:
+            self.trajectory = MotionProfile.trajectory(self.original_position, self.destination_position,
+                                                       duration, self.step, profile or self.profile)
+        self.destination_time = now + duration
+        if __debug__:
+            print(f"Channel {self.Channel}: {self.original_position} -> {self.destination_position} "
+                  f"over {duration}s ({profile or self.profile})")
+
+    def velocity_at(self, now):
+        """ Velocity (PWM/s) of the current move at the given time """
+        if not self.processing or now >= self.destination_time:
+            return 0.0
+        idx = min(int((now - self.destination_start) / self.step + 1e-6), len(self.trajectory) - 1)
+        if idx < 1:
+            return 0.0
+        return float(self.trajectory[idx] - self.trajectory[idx - 1]) / self.step
+
+    def position_at(self, now):
+        """ PWM value for the given time """
+        if self.destination_time <= now:
+            return self.destination_position
+        idx = int((now - self.destination_start) / self.step + 1e-6)
+        return int(self.trajectory[min(idx, len(self.trajectory) - 1)])
+
+    def progress(self, now):
+        """ How far through the current move the channel is, from 0 to 1 """
+        if not self.processing or now >= self.destination_time:
+            return 1.0
+        return (now - self.destination_start) / (self.destination_time - self.destination_start)
+
+    def state(self):
+        """ Snapshot of the channel for status reporting """
+        return {'channel': self.Channel,
+                'pwm': self.current_position,
+                'target': self.destination_position,
+                'moving': self.processing,
+                'progress': round(self.progress(time.monotonic()), 3),
+                'last_command': self.last_command,
+                'queue_depth': len(self.pending),
+                'dropped': self.dropped}
+
+    def next_deadline(self, deadline, now):
+        """ When this channel next needs a step after the one due at deadline, None once the move is done """
+        if self.pending:
+            # A command due to start later has its own STARTING entry on the heap to wake the channel
+            start = self.pending[0][3]
+            if start is None or start <= now:
+                return now + self.step
+        if now >= self.destination_time:
+            return None
+        next_step = deadline + self.step
+        if next_step <= now:
+            next_step = now + self.step
+        return min(next_step, self.destination_time)
+
+
+class ServoScheduler(threading.Thread):
+    """
+    One thread per PCA9685 board. Owns the interpolation state of every
+    channel on the board and keeps a min-heap of when each moving channel
+    next needs a step. The thread blocks on the command queue until the
+    earliest deadline, so an idle board uses no CPU.
+
+    Powering servos down after their hold time is handled by a timer wheel
+    of release_window wide slots. A finished channel is released in the
+    first slot after its hold time, so channels that finish close together
+    are powered down in the same write.
+    """
+
+    def __init__(self, address, tick_rate, mailbox=True, backend='pca9685', release_window=RELEASE_WINDOW):
+        if __debug__:
+            print(f"Initialising servo scheduler - {address} @ {tick_rate}Hz")
+        self.address = address
+        self.tick_rate = float(tick_rate)
+        self.mailbox = mailbox
+        self.q = Queue()
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.deadlines = []
+        self.release_window = float(release_window)
+        # slot number -> channels to release, and a heap of the slot numbers in use
+        self.releases = {}
+        self.release_slots = []
+        threading.Thread.__init__(self)
+        try:
+            self.i2c = get_device(self.address, busnum=1, frequency=60, backend=backend)
+        except Exception as e:
+            print(f"Failed to initialise servo board at {self.address}. Exception: {e}")
+            raise Exception("Failed to initialise servo board")
+        return
+
+    def add_channel(self, channel, Max, Min, Home, rate=None, profile=None, max_velocity=0, max_accel=0,
+                    hold=None):
+        """ Register a channel on this board, stepping at rate (default tick_rate) per second """
+        if rate is None:
+            rate = self.tick_rate
+        if hold is None:
+            hold = RELEASE_DELAY
+        self.channels[channel] = ServoChannel(channel, Max, Min, Home, rate, self.mailbox, profile or 'linear',
+                                              max_velocity, max_accel, hold)
+        return self.channels[channel]
+
+    def command(self, channel, position, duration, profile=None, start=None):
+        """
+        Queue a move for a channel, position is 0 to 1, duration in seconds
+
+        profile names one of MotionProfile.profiles, the channel's own
+        profile is used if it is not given. start is a time.monotonic() time
+        to begin the move at, so moves on different boards can share a tick.
+
+        In mailbox mode a command that has not started yet is replaced by the
+        new one and counted in the channel's dropped total. Otherwise every
+        command is started in turn, one per step.
+        """
+        servo = self.channels.get(channel)
+        if servo is None:
+            print(f"No servo on channel {self.address}/{channel}")
+            return
+        with self.lock:
+            if servo.mailbox and servo.pending:
+                servo.pending.clear()
+                servo.dropped += 1
+            servo.pending.append((position, duration, profile, start))
+            servo.last_command = time.time()
+        self.q.put(channel)
+
+    def home(self, channels, batch=4, stagger=0.02):
+        """
+        Send channels to their home positions, batch channels at a time
+
+        Each batch starts stagger seconds after the one before and goes out as
+        a single write, so boot is quick without every servo drawing current
+        at once.
+        """
+        start = time.monotonic()
+        for idx, channel in enumerate(channels):
+            self.command(channel, None, 0, None, start + (idx // batch) * stagger)
+
+    def _schedule(self, servo, deadline):
+        servo.generation += 1
+        heapq.heappush(self.deadlines, (deadline, servo.Channel, servo.generation))
+
+    def _hold(self, servo):
+        """ Put a channel that has reached its destination in the release slot after its hold time """
+        slot = int(math.ceil((servo.destination_time + servo.hold) / self.release_window))
+        servo.generation += 1
+        servo.release_slot = slot
+        if slot not in self.releases:
+            self.releases[slot] = set()
+            heapq.heappush(self.release_slots, slot)
+        self.releases[slot].add(servo.Channel)
+
+    def _next_deadline(self):
+        """ Earliest step or release time, None if the board is idle """
+        deadline = None
+        if self.deadlines:
+            deadline = self.deadlines[0][0]
+        if self.release_slots:
+            release = self.release_slots[0] * self.release_window
+            if deadline is None or release < deadline:
+                deadline = release
+        return deadline
+
+    def _start_pending(self, servo, now):
+        """ Start the next command waiting on a channel, or wait for its start time """
+        with self.lock:
+            if not servo.pending:
+                return
+            start = servo.pending[0][3]
+            if start is not None and start > now:
+                if servo.waiting_for != start:
+                    servo.waiting_for = start
+                    heapq.heappush(self.deadlines, (start, servo.Channel, STARTING))
+                return
+            position, duration, profile, start = servo.pending.popleft()
+        if start is None:
+            start = now
+        servo.start_move(position, duration, start, profile)
+        if servo.processing:
+            self._schedule(servo, start)
+
+    def _service(self, now):
+        """ Step every channel whose deadline has passed and release every due slot, in one batched write """
+        values = {}
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, channel, generation = heapq.heappop(self.deadlines)
+            servo = self.channels[channel]
+            if generation == STARTING:
+                if servo.waiting_for == deadline:
+                    servo.waiting_for = None
+                self._start_pending(servo, now)
+                continue
+            if generation != servo.generation:
+                continue
+            if servo.pending:
+                self._start_pending(servo, now)
+            position = servo.position_at(now)
+            values[channel] = (0, position)
+            servo.current_position = position
+            next_step = servo.next_deadline(deadline, now)
+            if next_step is None:
+                self._hold(servo)
+            else:
+                self._schedule(servo, next_step)
+        while self.release_slots and self.release_slots[0] * self.release_window <= now:
+            slot = heapq.heappop(self.release_slots)
+            for channel in self.releases.pop(slot):
+                servo = self.channels[channel]
+                if servo.release_slot != slot:
+                    continue
+                if __debug__:
+                    print(f"Resetting servo {self.address}/{channel}")
+                values[channel] = (4096, 0)
+                servo.release_slot = None
+                servo.processing = False
+        if values:
+            try:
+                self.i2c.write_channels(values)
+            except Exception:
+                print(f"Failed to send command {self.address} -> {values}")
+
+    def run(self):
+        if __debug__:
+            print(f"Starting servo scheduler {self.address}")
+        while True:
+            try:
+                self._run_once()
+            except Exception as e:
+                # Whatever command or step caused this has already been taken off the queue or heap
+                print(f"Servo scheduler {self.address} failed: {e}")
+
+    def _run_once(self):
+        """ Wait for a command or the next deadline, then start what was queued and step what is due """
+        timeout = None
+        deadline = self._next_deadline()
+        if deadline is not None:
+            timeout = max(0, deadline - time.monotonic())
+        try:
+            channel = self.q.get(timeout=timeout)
+            now = time.monotonic()
+            # Take everything queued so moves sent together start on the same tick
+            while True:
+                servo = self.channels[channel]
+                if servo.mailbox or not servo.processing or servo.release_slot is not None:
+                    self._start_pending(servo, now)
+                channel = self.q.get_nowait()
+        except Empty:
+            pass
+        self._service(time.monotonic())
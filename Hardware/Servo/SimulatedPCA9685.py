@@ -0,0 +1,119 @@
+""" In-memory PCA9685 for running the servo code without hardware """
+# ===============================================================================
+# Copyright (C) 2013 Darren Poulson
+#
+# This file is part of R2_Control.
+#
+# R2_Control is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# R2_Control is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with R2_Control.  If not, see <http://www.gnu.org/licenses/>.
+# ===============================================================================
+import collections
+import threading
+import time
+from builtins import object
+
+# Registers and bits, as in the Adafruit driver
+MODE1 = 0x00
+MODE2 = 0x01
+LED0_ON_L = 0x06
+ALL_LED_ON_L = 0xFA
+PRESCALE = 0xFE
+RESTART = 0x80
+SLEEP = 0x10
+ALLCALL = 0x01
+AI = 0x20
+OUTDRV = 0x04
+
+Transaction = collections.namedtuple('Transaction', 'time, register, data')
+
+# Most recent transactions kept by a SimulatedI2CDevice, older ones are dropped
+TRANSACTION_HISTORY = 100000
+
+
+class SimulatedI2CDevice(object):
+    """
+    Register file of a simulated PCA9685, with the same read/write calls as
+    an Adafruit_GPIO I2C device. Every bus transaction is recorded with a
+    time.monotonic() timestamp so benchmarks can count and time them. Only
+    the last history transactions are kept, so a long running simulated
+    board does not grow without limit.
+    """
+
+    def __init__(self, address, history=TRANSACTION_HISTORY):
+        self.address = address
+        self.registers = [0] * 256
+        self.transactions = collections.deque(maxlen=history)
+        self.lock = threading.Lock()
+
+    def _record(self, register, data):
+        self.transactions.append(Transaction(time=time.monotonic(), register=register, data=tuple(data)))
+
+    def write8(self, register, value):
+        with self.lock:
+            self._record(register, [value])
+            self.registers[register] = value & 0xFF
+
+    def writeList(self, register, data):
+        with self.lock:
+            self._record(register, data)
+            # Without auto-increment every byte lands on the same register
+            increment = 1 if self.registers[MODE1] & AI else 0
+            for idx, value in enumerate(data):
+                self.registers[(register + idx * increment) & 0xFF] = value & 0xFF
+
+    def readU8(self, register):
+        with self.lock:
+            return self.registers[register]
+
+    def reset(self):
+        """ Forget every recorded transaction """
+        with self.lock:
+            self.transactions.clear()
+
+
+class SimulatedPCA9685(object):
+    """ Stand in for Adafruit_PCA9685.PCA9685 backed by a SimulatedI2CDevice """
+
+    def __init__(self, address=0x40):
+        self._device = SimulatedI2CDevice(address)
+        self.set_all_pwm(0, 0)
+        self._device.write8(MODE2, OUTDRV)
+        self._device.write8(MODE1, ALLCALL)
+        mode1 = self._device.readU8(MODE1) & ~SLEEP
+        self._device.write8(MODE1, mode1)
+
+    def set_pwm_freq(self, freq_hz):
+        prescale = int(25000000.0 / 4096.0 / float(freq_hz) - 1.0 + 0.5)
+        oldmode = self._device.readU8(MODE1)
+        self._device.write8(MODE1, (oldmode & 0x7F) | SLEEP)
+        self._device.write8(PRESCALE, prescale)
+        self._device.write8(MODE1, oldmode)
+        self._device.write8(MODE1, oldmode | RESTART)
+
+    def set_pwm(self, channel, on, off):
+        register = LED0_ON_L + 4 * channel
+        for idx, value in enumerate([on & 0xFF, on >> 8, off & 0xFF, off >> 8]):
+            self._device.write8(register + idx, value)
+
+    def set_all_pwm(self, on, off):
+        for idx, value in enumerate([on & 0xFF, on >> 8, off & 0xFF, off >> 8]):
+            self._device.write8(ALL_LED_ON_L + idx, value)
+        for channel in range(16):
+            register = LED0_ON_L + 4 * channel
+            self._device.registers[register:register + 4] = [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+
+    def get_pwm(self, channel):
+        """ Current (on, off) of a channel, read back from the registers """
+        register = LED0_ON_L + 4 * channel
+        on_l, on_h, off_l, off_h = self._device.registers[register:register + 4]
+        return (on_l | (on_h << 8), off_l | (off_h << 8))
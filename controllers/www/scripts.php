@@ -26,22 +26,17 @@ if(isset($play)) {
 $url = "http://localhost:5000/scripts/running";
 $fh = fopen($url, "r");
 
-$convert = explode("\n", stream_get_contents($fh));
+$running_list = json_decode(stream_get_contents($fh), true);
 
-for ($i=0;$i<count($convert);$i++)
-{
-    $data = str_getcsv($convert[$i]);
-    if ($data != "")
-       $running_list[$i] = $data[0];
-}
-if (sizeof($running_list) > 1) {
+if (!empty($running_list)) {
     echo "Running scripts: <br>";
     echo "<ul>\n";
 
-    for ($x = 0 ; $x < sizeof($running_list) - 1; $x++) {
-        list($id, $name) = explode(":", $running_list[$x]);
+    foreach ($running_list as $script) {
+        $id = $script["id"];
+        $name = $script["name"];
         echo " <li>Running: $name ($id) <a href=\"?page=scripts&stop=".$id."\">stop</a></li>";
-    } 
+    }
 
     echo "</ul>\n";
 }
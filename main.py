@@ -25,9 +25,11 @@ import time
 import datetime
 import logging
 import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, render_template
 from r2utils import telegram, internet, mainconfig
 from Hardware.Servo import ServoBlueprint
+from Hardware.Servo.ServoControl import ServoControl
 from future import standard_library
 standard_library.install_aliases()
 
@@ -160,13 +162,15 @@ def index():
     return render_template('index.html', urls=urls)
 
 
-# Initialise server controllers
+# Initialise server controllers, bringing the boards up in parallel
 if __debug__:
     print("Servos loading.... %s" % servos)
-for x in servos:
-    if x != '':
-        logging.info(f"Loading Servo Control Board: {x}")
-        app.register_blueprint(ServoBlueprint.construct_blueprint(x), url_prefix="/" + x)
+servo_boards = [x for x in servos if x != '']
+with ThreadPoolExecutor(max_workers=max(len(servo_boards), 1)) as pool:
+    servo_controls = dict(zip(servo_boards, pool.map(ServoControl, servo_boards)))
+for x in servo_boards:
+    logging.info(f"Loading Servo Control Board: {x}")
+    app.register_blueprint(ServoBlueprint.construct_blueprint(x, servo_controls[x]), url_prefix="/" + x)
 
 p = {}
 for x in plugins:
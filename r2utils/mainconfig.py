@@ -4,7 +4,7 @@ import configparser
 import os
 standard_library.install_aliases()
 
-_configdir = '/home/pi/.r2_config/'
+_configdir = os.environ.get('R2_CONFIG_DIR', '/home/pi/.r2_config/')
 if not os.path.exists(_configdir):
     os.makedirs(_configdir)
 _configfile = _configdir + 'main.cfg'